@@ -1,36 +1,94 @@
-import datetime as dt
-import os
-from wsgiref.util import FileWrapper
+import csv
+from collections import defaultdict
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import StreamingHttpResponse
 
+from recipes.models import Recipe
 
-def download_file(query):
-    f_data = []
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def txt_lines(query):
     for i, ingredient in enumerate(query, 1):
-        f_data.append(
-            '{}) {} {} {};'.format(
-                i,
-                ingredient['ingredient__name'],
-                ingredient['amount'],
-                ingredient["ingredient__measurement_unit"]
-            )
+        yield '{}) {} {} {};\n'.format(
+            i,
+            ingredient['ingredient__name'],
+            ingredient['amount'],
+            ingredient['ingredient__measurement_unit']
         )
-    f_text = '\n'.join(f_data)
-    basename = 'shopping_cart'
-    suffix = dt.datetime.now().strftime("%y%m%d_%H%M%S")
-    f_name = "_".join([basename, suffix])
-    f = open(f'{f_name}.txt', 'a')
-    f.write(f_text)
-    f.close()
-    f = open(f'{f_name}.txt', 'r')
-    response = HttpResponse(
-        FileWrapper(f),
-        content_type='application/msword'
+
+
+def csv_lines(query):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for ingredient in query:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['amount'],
+            ingredient['ingredient__measurement_unit']
+        ))
+
+
+FILE_FORMATS = {
+    'txt': (txt_lines, 'text/plain; charset=utf-8'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+}
+
+
+def download_file(query, file_format='txt'):
+    lines, content_type = FILE_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        lines(query.iterator()),
+        content_type=content_type
     )
     response['Content-Disposition'] = (
         'attachment; '
-        f'filename="{f_name}.txt"'
+        f'filename="shopping_cart.{file_format}"'
     )
-    os.remove(f'{f_name}.txt')
     return response
+
+
+def get_recipes_limit(request):
+    try:
+        recipes_limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return settings.RECIPES_LIMIT_MAX
+    return min(max(recipes_limit, 0), settings.RECIPES_LIMIT_MAX)
+
+
+def attach_recipe_previews(authors, recipes_limit):
+    """Load the newest recipes of a page of authors in one query.
+
+    A ROW_NUMBER() window per author keeps at most ``recipes_limit``
+    recipes each; they are stored on the authors as ``recipe_previews``.
+    """
+    authors = list(authors)
+    if not authors or not recipes_limit:
+        for author in authors:
+            author.recipe_previews = []
+        return authors
+    author_ids = [author.id for author in authors]
+    previews_sql = (
+        'SELECT id, author_id, name, image, image_thumbnail, cooking_time '
+        'FROM (SELECT id, author_id, name, image, image_thumbnail, '
+        'cooking_time, '
+        'ROW_NUMBER() OVER (PARTITION BY author_id '
+        'ORDER BY pub_date DESC, id DESC) AS rn '
+        'FROM {table} WHERE author_id IN ({ids})'
+        ') ranked WHERE rn <= %s ORDER BY author_id, rn'
+    ).format(
+        table=Recipe._meta.db_table,
+        ids=', '.join(['%s'] * len(author_ids))
+    )
+    previews = defaultdict(list)
+    for recipe in Recipe.objects.raw(
+        previews_sql, [*author_ids, recipes_limit]
+    ):
+        previews[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recipe_previews = previews[author.id]
+    return authors
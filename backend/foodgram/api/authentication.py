@@ -0,0 +1,121 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+# Counters are changed with F() updates, so cached users load them on
+# access instead of carrying values a later save() would write back.
+DEFERRED_USER_FIELDS = ('user__recipes_count', 'user__subscribers_count')
+
+
+class TokenCache:
+    """Bounded LRU of token key -> token with its user, with a TTL.
+
+    Each worker keeps its own entries; with ``shared`` a miss is looked
+    up in the default Django cache before going to the database.
+    """
+
+    def __init__(self, size, ttl, shared=False):
+        self.size = size
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def shared_key(self, key):
+        return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, token = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return token
+                self._remove(key)
+        if not self.shared:
+            return None
+        token = cache.get(self.shared_key(key))
+        if token is not None:
+            self.set(key, token, shared=False)
+        return token
+
+    def set(self, key, token, shared=True):
+        if not self.size:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, token)
+            self._users.setdefault(token.user_id, set()).add(key)
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+        if shared and self.shared:
+            cache.set(self.shared_key(key), token, self.ttl)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._users.get(entry[1].user_id)
+            keys.discard(key)
+            if not keys:
+                del self._users[entry[1].user_id]
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+        if self.shared:
+            cache.delete(self.shared_key(key))
+
+    def discard_user(self, user_id):
+        with self._lock:
+            keys = set(self._users.get(user_id, ()))
+            for key in keys:
+                self._remove(key)
+        if self.shared:
+            keys.update(
+                Token.objects.filter(user_id=user_id).values_list(
+                    'key', flat=True
+                )
+            )
+            cache.delete_many([self.shared_key(key) for key in keys])
+
+
+token_cache = TokenCache(
+    settings.AUTH_TOKEN_CACHE_SIZE,
+    settings.AUTH_TOKEN_CACHE_TTL,
+    settings.AUTH_TOKEN_CACHE_SHARED
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that skips the token/user query for tokens
+    seen within ``AUTH_TOKEN_CACHE_TTL`` seconds."""
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').defer(
+                    *DEFERRED_USER_FIELDS
+                ).get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(
+                    _('User inactive or deleted.')
+                )
+            token_cache.set(key, token)
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token.user, token
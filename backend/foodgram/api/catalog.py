@@ -0,0 +1,75 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+from recipes.versions import get_version
+
+
+class IngredientCatalog:
+    """Read-only snapshot of all ingredients held by one worker.
+
+    Rows are kept in id order for listing; prefix search bisects a
+    parallel sorted array of casefolded names.
+    """
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.loaded = time.monotonic()
+        self.rows = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for pk, name, measurement_unit in sorted(rows)
+        ]
+        self.positions = {row['id']: i for i, row in enumerate(self.rows)}
+        order = sorted(
+            range(len(self.rows)),
+            key=lambda i: (self.rows[i]['name'].casefold(), i)
+        )
+        self.keys = [self.rows[i]['name'].casefold() for i in order]
+        self.order = array('l', order)
+
+    def all(self):
+        return self.rows
+
+    def get(self, pk):
+        position = self.positions.get(pk)
+        return None if position is None else self.rows[position]
+
+    def search(self, value):
+        """Prefix matches first, then names containing ``value``."""
+        value = value.casefold()
+        found = []
+        for i in range(bisect_left(self.keys, value), len(self.keys)):
+            if not self.keys[i].startswith(value):
+                break
+            found.append(self.order[i])
+        prefixed = set(found)
+        found.extend(
+            self.order[i] for i, key in enumerate(self.keys)
+            if value in key and self.order[i] not in prefixed
+        )
+        return [self.rows[position] for position in found]
+
+
+_catalog = None
+_lock = threading.Lock()
+
+
+def get_catalog(version=None):
+    global _catalog
+    if version is None:
+        version = get_version('ingredients')
+    with _lock:
+        if (_catalog is None or _catalog.version != version
+                or time.monotonic() - _catalog.loaded
+                > settings.INGREDIENT_CATALOG_TTL):
+            _catalog = IngredientCatalog(
+                Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                ),
+                version
+            )
+        return _catalog
@@ -0,0 +1,46 @@
+from django.utils.functional import cached_property
+
+from recipes.models import Favorite, ShoppingCart, Subscription
+
+
+class ViewerContext:
+    """Relations of the current user, loaded once per request."""
+
+    def __init__(self, user):
+        self.user = user
+
+    def _ids(self, model, field):
+        if self.user.is_anonymous:
+            return frozenset()
+        return frozenset(
+            model.objects.filter(user=self.user).values_list(field, flat=True)
+        )
+
+    @cached_property
+    def subscribed_ids(self):
+        return self._ids(Subscription, 'author_id')
+
+    @cached_property
+    def favorite_ids(self):
+        return self._ids(Favorite, 'recipes_id')
+
+    @cached_property
+    def cart_ids(self):
+        return self._ids(ShoppingCart, 'recipes_id')
+
+    def is_subscribed(self, author):
+        return author.pk in self.subscribed_ids
+
+    def is_favorited(self, recipe):
+        return recipe.pk in self.favorite_ids
+
+    def is_in_shopping_cart(self, recipe):
+        return recipe.pk in self.cart_ids
+
+
+def get_viewer_context(request):
+    viewer = getattr(request, '_viewer_context', None)
+    if viewer is None:
+        viewer = ViewerContext(request.user)
+        request._viewer_context = viewer
+    return viewer
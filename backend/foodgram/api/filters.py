@@ -1,13 +1,18 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeTag,
+                            ShoppingCart, Tag)
+
+from .search import search_ingredients
 
 
 class UserRecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name="slug",
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='filter_tags'
     )
     is_favorited = filters.BooleanFilter(
         method='filter_is_favorited'
@@ -20,27 +25,39 @@ class UserRecipeFilter(FilterSet):
         model = Recipe
         fields = ('author', 'tags')
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'),
+            tags__in=value
+        )))
+
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            queryset = queryset.filter(
-                favorite__user=self.request.user
-            )
+            queryset = queryset.filter(Exists(Favorite.objects.filter(
+                user=self.request.user,
+                recipes=OuterRef('pk')
+            )))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            queryset = queryset.filter(
-                shopping_cart__user=self.request.user
-            )
+            queryset = queryset.filter(Exists(ShoppingCart.objects.filter(
+                user=self.request.user,
+                recipes=OuterRef('pk')
+            )))
         return queryset
 
 
 class IngredientFilter(FilterSet):
     name = filters.CharFilter(
-        field_name='name',
-        lookup_expr='istartswith'
+        method='filter_name'
     )
 
     class Meta:
         model = Ingredient
         fields = ('name',)
+
+    def filter_name(self, queryset, name, value):
+        return search_ingredients(queryset, value)
@@ -0,0 +1,71 @@
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from recipes.versions import get_versions
+
+_responses = {}
+RESPONSES_MAX = 256
+
+
+class ConditionalGetMixin:
+    """ETag/Last-Modified for list and retrieve, answered with 304.
+
+    Responses are versioned by ``get_version_names()``; anything else the
+    body depends on (e.g. the current user) goes to ``get_etag_parts()``.
+    With ``cache_responses`` bodies are also kept in process memory.
+    """
+    version_names = ()
+    conditional_actions = ('list', 'retrieve')
+    cache_responses = False
+
+    def get_version_names(self):
+        return self.version_names
+
+    def get_etag_parts(self):
+        return ()
+
+    def conditional(self, respond, request, *args, **kwargs):
+        versions = self.versions = get_versions(self.get_version_names())
+        parts = self.get_etag_parts()
+        etag = '"{}"'.format(md5('|'.join(
+            str(part) for part in (request.get_full_path(), *versions, *parts)
+        ).encode()).hexdigest())
+        # Per-user parts change without a version bump, so only the ETag
+        # can describe such responses.
+        last_modified = None if parts else int(max(versions))
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = self.cached_response(etag)
+        if response is None:
+            response = respond(request, *args, **kwargs)
+            if self.cache_responses and response.status_code == 200:
+                if len(_responses) >= RESPONSES_MAX:
+                    _responses.clear()
+                _responses[etag] = response.data
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if parts:
+                patch_vary_headers(response, ('Authorization',))
+            else:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def cached_response(self, etag):
+        if not self.cache_responses or etag not in _responses:
+            return None
+        return Response(_responses[etag])
+
+    def list(self, request, *args, **kwargs):
+        if 'list' not in self.conditional_actions:
+            return super().list(request, *args, **kwargs)
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if 'retrieve' not in self.conditional_actions:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,181 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from recipes.models import RecipeRank, TimelineEntry
+
+
+class FeedPagination(LimitOffsetPagination):
+    """Limit/offset pagination with an opt-in keyset (cursor) mode.
+
+    ``?cursor=`` switches to keyset pagination over ``ordering``: each
+    page is one index range scan, whatever the depth. In limit/offset
+    mode ``?count=false`` skips the total and ``?count=estimate`` takes
+    it from the PostgreSQL planner.
+    """
+    ordering = ('-id',)
+    cursor_default_limit = 10
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.cursor = None
+        if self.cursor_query_param in request.query_params:
+            return self.paginate_by_cursor(queryset, request)
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode != 'false':
+            return super().paginate_queryset(queryset, request, view)
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.count = None
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(page) > self.limit
+        return page[:self.limit]
+
+    def get_count(self, queryset):
+        count_mode = self.request.query_params.get(self.count_query_param)
+        if count_mode == 'estimate' and connection.vendor == 'postgresql':
+            return estimate_count(queryset)
+        return super().get_count(queryset)
+
+    def get_next_link(self):
+        if self.cursor is not None:
+            if not self.has_next:
+                return None
+            return replace_query_param(
+                self.request.build_absolute_uri(),
+                self.cursor_query_param,
+                self.cursor
+            )
+        if self.count is None:
+            if not self.has_next:
+                return None
+            return replace_query_param(
+                self.request.build_absolute_uri(),
+                self.offset_query_param,
+                self.offset + self.limit
+            )
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.cursor is not None:
+            return None
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        if self.cursor is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def paginate_by_cursor(self, queryset, request):
+        self.limit = self.get_limit(request) or self.cursor_default_limit
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(
+            request.query_params[self.cursor_query_param], queryset.model
+        )
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        page = list(queryset[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        self.cursor = self.encode_cursor(page[-1]) if page else ''
+        return page
+
+    def after(self, position):
+        """Rows strictly after ``position`` in ``ordering``."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, obj):
+        position = [
+            getattr(obj, field.lstrip('-')) for field in self.ordering
+        ]
+        raw = json.dumps(position, default=str).encode()
+        return urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, cursor, model):
+        if not cursor:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(cursor.encode()))
+            if (not isinstance(position, list)
+                    or len(position) != len(self.ordering)
+                    or None in position):
+                raise ValueError(position)
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, LookupError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class RecipePagination(FeedPagination):
+    ordering = ('-pub_date', '-id')
+
+
+class UserPagination(FeedPagination):
+    ordering = ('id',)
+
+
+class TimelinePagination(RecipePagination):
+    """Keyset pages of the request user's subscription feed.
+
+    Rows come from ``TimelineEntry.objects.page``; the queryset passed
+    in only loads the recipes of the page.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request) or self.cursor_default_limit
+        position = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param, ''),
+            queryset.model
+        )
+        rows = TimelineEntry.objects.page(
+            request.user, position, self.limit + 1
+        )
+        self.has_next = len(rows) > self.limit
+        recipes = queryset.in_bulk([pk for _, pk in rows[:self.limit]])
+        page = [recipes[pk] for _, pk in rows[:self.limit] if pk in recipes]
+        self.cursor = self.encode_cursor(page[-1]) if page else ''
+        return page
+
+
+class TrendingPagination(FeedPagination):
+    """Pages recipes annotated with their ``position`` in the ranking."""
+    ordering = ('position',)
+
+    def decode_cursor(self, cursor, model):
+        return super().decode_cursor(cursor, RecipeRank)
+
+
+def estimate_count(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
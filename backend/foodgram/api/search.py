@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+
+from .catalog import get_catalog
+
+
+def search_ingredients(queryset, value):
+    """Prefix matches first, then names containing ``value``."""
+    if (connection.vendor != 'postgresql'
+            and settings.INGREDIENT_CATALOG_TTL):
+        # Elsewhere LIKE only ignores the case of ASCII letters, so the
+        # catalog searches unless it is disabled.
+        found = [row['id'] for row in get_catalog().search(value)]
+        return queryset.filter(id__in=found).order_by(
+            Case(
+                *[
+                    When(id=pk, then=Value(rank))
+                    for rank, pk in enumerate(found)
+                ],
+                output_field=IntegerField()
+            )
+        )
+    # On PostgreSQL prefix hits come from a subquery on the UPPER(name)
+    # text_pattern_ops index, the rest from the trigram index.
+    prefixed = queryset.filter(name__istartswith=value).values('pk')
+    return queryset.filter(
+        name__icontains=value
+    ).annotate(
+        prefix_rank=Case(
+            When(pk__in=prefixed, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField()
+        )
+    ).order_by('prefix_rank', 'name')
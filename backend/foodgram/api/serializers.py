@@ -1,14 +1,85 @@
+from io import BytesIO
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import Http404
 from djoser.serializers import UserCreateSerializer
-from drf_extra_fields.fields import Base64ImageField
+from drf_extra_fields.fields import Base64FileField
+from PIL import Image
 from rest_framework import serializers
 
-from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.images import process_image
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCartIngredient, Tag)
+from recipes.versions import bump_version
+
+from .actions import get_recipes_limit
+from .context import get_viewer_context
 
 User = get_user_model()
 
 
+class UploadedImageField(Base64FileField):
+    """Base64 image stored as is; the signature and headers are checked.
+
+    Pixels are decoded and resized later in ``recipes.images``.
+    """
+    ALLOWED_TYPES = ('jpg', 'png', 'gif', 'webp')
+    INVALID_FILE_MESSAGE = 'Загрузите корректное изображение.'
+    INVALID_TYPE_MESSAGE = 'Неподдерживаемый формат изображения.'
+    TOO_LARGE_MESSAGE = 'Изображение больше {} пикселей.'
+    SIGNATURES = (
+        (b'\xff\xd8\xff', 'jpg'),
+        (b'\x89PNG\r\n\x1a\n', 'png'),
+        (b'GIF87a', 'gif'),
+        (b'GIF89a', 'gif'),
+    )
+
+    def get_file_extension(self, filename, decoded_file):
+        if decoded_file[:4] == b'RIFF' and decoded_file[8:12] == b'WEBP':
+            extension = 'webp'
+        else:
+            extension = next((
+                extension for signature, extension in self.SIGNATURES
+                if decoded_file.startswith(signature)
+            ), None)
+        if extension is not None:
+            self.verify(decoded_file)
+        return extension
+
+    def verify(self, decoded_file):
+        # Only headers are read here: verify() decodes no pixels.
+        try:
+            with Image.open(BytesIO(decoded_file)) as image:
+                pixels = image.width * image.height
+                if pixels > settings.IMAGE_MAX_PIXELS:
+                    raise serializers.ValidationError(
+                        self.TOO_LARGE_MESSAGE.format(
+                            settings.IMAGE_MAX_PIXELS
+                        )
+                    )
+                image.verify()
+        except (OSError, SyntaxError, ValueError,
+                Image.DecompressionBombError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+
+
+class ImageVariantField(serializers.ImageField):
+    """URL of a resized recipe image, or of the original until the
+    variant is made."""
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return super().to_representation(
+            getattr(recipe, self.variant) or recipe.image
+        )
+
+
 class UserSerializer(UserCreateSerializer):
     class Meta(UserCreateSerializer.Meta):
         model = User
@@ -36,13 +107,13 @@ class MyUserSerializer(serializers.ModelSerializer):
             'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.subscriber.filter(author=obj).exists()
+        request = self.context.get('request')
+        return get_viewer_context(request).is_subscribed(obj)
 
 
 class RecipeUser(serializers.ModelSerializer):
+    image = ImageVariantField('image_thumbnail')
+
     class Meta:
         model = Recipe
         fields = (
@@ -70,7 +141,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 class SubscriptionSerializer(RecipeUser):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -86,18 +157,19 @@ class SubscriptionSerializer(RecipeUser):
         )
 
     def get_recipes(self, obj):
-        queryset = Recipe.objects.filter(author=obj)
+        if hasattr(obj, 'recipe_previews'):
+            queryset = obj.recipe_previews
+        else:
+            recipes_limit = get_recipes_limit(self.context.get('request'))
+            queryset = Recipe.objects.filter(author=obj)[:recipes_limit]
         return RecipeUser(
             queryset,
             many=True
         ).data
 
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
-
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return user.subscriber.filter(author=obj).exists()
+        request = self.context.get('request')
+        return get_viewer_context(request).is_subscribed(obj)
 
 
 class RecipesIngredientsSerializer(serializers.HyperlinkedModelSerializer):
@@ -151,7 +223,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = IngredientWriteSerializer(many=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
-    image = Base64ImageField()
+    image = UploadedImageField()
 
     class Meta:
         model = Recipe
@@ -169,68 +241,106 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return obj.favorite.filter(
-            user=user,
-        ).exists()
+        request = self.context.get('request')
+        return get_viewer_context(request).is_favorited(obj)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return obj.shopping_cart.filter(
-            user=user,
-        ).exists()
+        request = self.context.get('request')
+        return get_viewer_context(request).is_in_shopping_cart(obj)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags_data)
         self.add_ingredients(ingredients_data, recipe)
-        recipe.save()
+        if recipe.image:
+            process_image(recipe.id)
         return recipe
 
     def validate(self, data):
         ingredients = data.pop('ingredients')
-        ingredient_list = []
-        for item in ingredients:
-            ingredient = get_object_or_404(
-                Ingredient,
-                id=item['id']
+        ingredient_ids = [item['id'] for item in ingredients]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise serializers.ValidationError(
+                'Ингредиент уже добавлен'
             )
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError(
-                    'Ингредиент уже добавлен'
-                )
-            ingredient_list.append(ingredient)
+        found = Ingredient.objects.filter(
+            id__in=ingredient_ids
+        ).values_list('id', flat=True)
+        if len(found) != len(ingredient_ids):
+            raise Http404('Ингредиент не найден')
         data['ingredients'] = ingredients
         return data
 
     def add_ingredients(self, ingredients, recipe):
-        for item in ingredients:
-            amount = item.get('amount')
-            ingredient = get_object_or_404(
-                Ingredient,
-                pk=item['id'])
-            RecipeIngredient.objects.create(
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
                 recipe=recipe,
-                ingredient=ingredient,
-                amount=amount
-            )
+                ingredient_id=item['id'],
+                amount=item['amount']
+            ) for item in ingredients
+        )
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients')
-        super().update(instance, validated_data)
-        RecipeIngredient.objects.filter(
-            recipe=instance
-        ).delete()
-        self.add_ingredients(ingredients_data, instance)
-        instance.save()
+        tags_data = validated_data.pop('tags', None)
+        changed = [
+            attr for attr, value in validated_data.items()
+            if getattr(instance, attr) != value
+        ]
+        for attr in changed:
+            setattr(instance, attr, validated_data[attr])
+        if 'image' in changed:
+            instance.image_thumbnail = instance.image_medium = ''
+            changed += ['image_thumbnail', 'image_medium']
+            process_image(instance.id)
+        if changed:
+            instance.save(update_fields=changed)
+        else:
+            # Only tags or ingredients may change: post_save, which bumps
+            # the version otherwise, is not sent.
+            transaction.on_commit(
+                lambda: bump_version(f'recipe:{instance.pk}')
+            )
+        if tags_data is not None:
+            instance.tags.set(tags_data)
+        self.update_ingredients(ingredients_data, instance)
         return instance
 
+    def update_ingredients(self, ingredients, recipe):
+        new_amounts = {item['id']: item['amount'] for item in ingredients}
+        amounts = dict(new_amounts)
+        existing = {}
+        to_delete = []
+        to_update = []
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+            recipe=recipe
+        ):
+            ingredient_id = recipe_ingredient.ingredient_id
+            amounts[ingredient_id] = (
+                amounts.get(ingredient_id, 0) - recipe_ingredient.amount
+            )
+            if (ingredient_id not in new_amounts
+                    or ingredient_id in existing):
+                to_delete.append(recipe_ingredient.id)
+                continue
+            existing[ingredient_id] = recipe_ingredient
+            if recipe_ingredient.amount != new_amounts[ingredient_id]:
+                recipe_ingredient.amount = new_amounts[ingredient_id]
+                to_update.append(recipe_ingredient)
+        if to_delete:
+            RecipeIngredient.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        self.add_ingredients(
+            [item for item in ingredients if item['id'] not in existing],
+            recipe
+        )
+        ShoppingCartIngredient.objects.change_recipe(recipe, amounts)
+
 
 class RecipeSerializerGet(RecipeSerializer):
     tags = TagSerializer(
@@ -241,7 +351,9 @@ class RecipeSerializerGet(RecipeSerializer):
         many=True,
         source='recipeingredient_set',
     )
+    image = ImageVariantField('image_medium')
+    image_thumbnail = ImageVariantField('image_thumbnail')
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        exclude = ('image_medium',)
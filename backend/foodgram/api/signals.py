@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+
+User = get_user_model()
+
+
+# Entries are dropped at once and again after commit, in case a
+# concurrent request cached the old rows in between.
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.discard(instance.key)
+    transaction.on_commit(lambda: token_cache.discard(instance.key))
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, **kwargs):
+    if not created:
+        token_cache.discard_user(instance.pk)
+        transaction.on_commit(lambda: token_cache.discard_user(instance.pk))
+
+
+@receiver(user_logged_out)
+def logged_out(sender, user, **kwargs):
+    if user is not None:
+        token_cache.discard_user(user.pk)
@@ -0,0 +1,396 @@
+import base64
+import json
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from foodgram.metrics import REQUEST_QUERIES
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Subscription, Tag, Version)
+
+User = get_user_model()
+
+GIF = (
+    'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEA'
+    'AAIBRAA7'
+)
+
+
+class ApiTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com', password='pass'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        cls.tags = [
+            Tag.objects.create(name=slug, slug=slug, color='#000000')
+            for slug in ('breakfast', 'lunch')
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {index}', measurement_unit='г')
+            for index in range(30)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_recipes(self, number, author=None):
+        recipes = []
+        for index in range(number):
+            recipe = Recipe.objects.create(
+                author=author or self.author,
+                name=f'рецепт {index}',
+                text='текст',
+                cooking_time=10
+            )
+            recipe.tags.set(self.tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=5
+                ) for ingredient in self.ingredients[:3]
+            )
+            recipes.append(recipe)
+        return recipes
+
+
+class RecipeListQueriesTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        recipes = self.make_recipes(20)
+        Subscription.objects.create(user=self.user, author=self.author)
+        for recipe in recipes[::2]:
+            Favorite.objects.create(user=self.user, recipes=recipe)
+            ShoppingCart.objects.create(user=self.user, recipes=recipe)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for limit in (2, 20):
+            with self.subTest(limit=limit), self.assertNumQueries(7):
+                response = self.client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(len(response.data['results']), limit)
+
+
+class UploadTestCase(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class CursorPaginationTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = self.make_recipes(10)
+        # Equal dates make the id the only tie-breaker.
+        Recipe.objects.update(pub_date=timezone.now())
+
+    def test_every_row_once(self):
+        seen = []
+        url = '/api/recipes/?cursor=&limit=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(
+            seen, sorted((recipe.id for recipe in self.recipes), reverse=True)
+        )
+
+    def test_malformed_cursor(self):
+        for url, position in (
+            ('/api/recipes/', ['garbage', 1]),
+            ('/api/recipes/', [1]),
+            ('/api/recipes/', {'id': 1}),
+            ('/api/recipes/', [None, None]),
+            ('/api/recipes/feed/', ['garbage', 1]),
+            ('/api/users/subscriptions/', ['a']),
+            ('/api/recipes/trending/', ['a']),
+        ):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(position).encode()
+            ).decode()
+            with self.subTest(url=url, position=position):
+                response = self.client.get(url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/recipes/', {'cursor': '%%%'})
+        self.assertEqual(response.status_code, 404)
+
+
+class IngredientSearchTest(ApiTestCase):
+
+    @override_settings(INGREDIENT_CATALOG_TTL=0)
+    def test_database_search(self):
+        Ingredient.objects.create(
+            name='мука ингредиент 2', measurement_unit='г'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/ingredients/', {'name': 'ингредиент 2'}
+            )
+        self.assertEqual(len([
+            query for query in queries
+            if 'recipes_ingredient' in query['sql']
+        ]), 1)
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data],
+            ['ингредиент 2', 'ингредиент 20', 'ингредиент 21',
+             'ингредиент 22', 'ингредиент 23', 'ингредиент 24',
+             'ингредиент 25', 'ингредиент 26', 'ингредиент 27',
+             'ингредиент 28', 'ингредиент 29', 'мука ингредиент 2']
+        )
+
+
+class RecipeCreateQueriesTest(UploadTestCase):
+
+    def create_recipe(self, ingredients):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/recipes/', {
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': 10}
+                    for ingredient in ingredients
+                ],
+                'tags': [tag.id for tag in self.tags],
+                'name': 'рецепт',
+                'text': 'текст',
+                'cooking_time': 10,
+                'image': GIF,
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            RecipeIngredient.objects.filter(
+                recipe_id=response.data['id']
+            ).count(),
+            len(ingredients)
+        )
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_ingredient_count(self):
+        self.assertEqual(
+            self.create_recipe(self.ingredients[:1]),
+            self.create_recipe(self.ingredients[:30])
+        )
+
+
+def data_uri(content, mime_type):
+    return f'data:{mime_type};base64,{base64.b64encode(content).decode()}'
+
+
+@override_settings(IMAGE_WORKERS=0)
+class RecipeImageTest(UploadTestCase):
+
+    def post_image(self, image):
+        return self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 10}],
+            'tags': [self.tags[0].id],
+            'name': 'рецепт',
+            'text': 'текст',
+            'cooking_time': 10,
+            'image': image,
+        }, format='json')
+
+    def test_broken_image_is_rejected(self):
+        response = self.post_image(
+            data_uri(b'\x89PNG\r\n\x1a\n' + b'garbage' * 10, 'image/png')
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_too_many_pixels(self):
+        buffer = BytesIO()
+        Image.new('RGB', (100, 100)).save(buffer, 'PNG')
+        with override_settings(IMAGE_MAX_PIXELS=100 * 99):
+            response = self.post_image(
+                data_uri(buffer.getvalue(), 'image/png')
+            )
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_variants_are_logged(self):
+        buffer = BytesIO()
+        Image.new('RGB', (400, 400), 'red').save(buffer, 'JPEG')
+        truncated = buffer.getvalue()[:buffer.tell() // 2]
+        with self.assertLogs('recipes.images', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post_image(
+                    data_uri(truncated, 'image/jpeg')
+                )
+        self.assertEqual(response.status_code, 201)
+
+
+class RepeatedAddTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, = self.make_recipes(1)
+
+    def assert_added_once(self, url, rows):
+        first = self.client.post(url)
+        second = self.client.post(url)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(rows.count(), 1)
+
+    def test_favorite(self):
+        self.assert_added_once(
+            f'/api/recipes/{self.recipe.id}/favorite/',
+            Favorite.objects.filter(user=self.user, recipes=self.recipe)
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_shopping_cart(self):
+        self.assert_added_once(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/',
+            ShoppingCart.objects.filter(user=self.user, recipes=self.recipe)
+        )
+        self.assertEqual(
+            list(self.user.shopping_cart_ingredients.values_list(
+                'amount', flat=True
+            )),
+            [5, 5, 5]
+        )
+
+    def test_subscribe(self):
+        self.assert_added_once(
+            f'/api/users/{self.author.id}/subscribe/',
+            Subscription.objects.filter(user=self.user, author=self.author)
+        )
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 1)
+
+
+class RequestMetricsTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, = self.make_recipes(1)
+        self.client.post(f'/api/recipes/{self.recipe.id}/shopping_cart/')
+
+    def test_download_queries_are_counted(self):
+        labels = (
+            ('method', 'GET'), ('route', 'recipe-download_shopping_cart')
+        )
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        before = REQUEST_QUERIES._series.get(labels, {'sum': 0})['sum']
+        self.assertIn(b'5', b''.join(response.streaming_content))
+        self.assertEqual(REQUEST_QUERIES._series[labels]['sum'], before + 1)
+
+
+class ShoppingListCascadeTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, = self.make_recipes(1)
+        self.client.post(f'/api/recipes/{self.recipe.id}/shopping_cart/')
+
+    def assert_list_empty(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(b''.join(response.streaming_content).strip(), b'')
+
+    def test_author_deleted(self):
+        author_client = APIClient()
+        author_client.force_authenticate(self.author)
+        response = author_client.delete(
+            '/api/users/me/', {'current_password': 'pass'}, format='json'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assert_list_empty()
+
+    def test_recipe_deleted(self):
+        self.recipe.delete()
+        self.assert_list_empty()
+
+    def delete_author_queries(self, number):
+        author = User.objects.create_user(
+            username=f'author{number}',
+            email=f'author{number}@example.com',
+            password='pass'
+        )
+        for recipe in self.make_recipes(number, author):
+            self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        with CaptureQueriesContext(connection) as queries:
+            author.delete()
+        return len(queries)
+
+    def test_author_delete_queries_do_not_grow(self):
+        self.assertEqual(
+            self.delete_author_queries(1), self.delete_author_queries(5)
+        )
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().count('\n'), 3
+        )
+
+
+class RecipeEtagTest(ApiTestCase):
+
+    def test_favorited_by_another_user(self):
+        recipe, = self.make_recipes(1)
+        url = f'/api/recipes/{recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        author_client = APIClient()
+        author_client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            author_client.post(f'{url}favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['favorites_count'], 1)
+
+    @override_settings(VERSION_CACHE_TTL=0)
+    def test_bumped_by_another_process(self):
+        recipe, = self.make_recipes(1)
+        url = f'/api/recipes/{recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        Version.objects.filter(name=f'recipe:{recipe.id}').update(
+            value=F('value') + 1
+        )
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200
+        )
+
+    def test_update_bumps_version_once(self):
+        recipe, = self.make_recipes(1)
+        url = f'/api/recipes/{recipe.id}/'
+        author_client = APIClient()
+        author_client.force_authenticate(self.author)
+        ingredients = [{'id': self.ingredients[0].id, 'amount': 5}]
+        for data in ({'name': 'новое имя'}, {'tags': [self.tags[0].id]}):
+            etag = self.client.get(url)['ETag']
+            with self.subTest(data=data):
+                with CaptureQueriesContext(connection) as queries:
+                    with self.captureOnCommitCallbacks(execute=True):
+                        response = author_client.patch(
+                            url, {'ingredients': ingredients, **data},
+                            format='json'
+                        )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len([
+                    query for query in queries
+                    if query['sql'].startswith('UPDATE "recipes_version"')
+                ]), 1)
+                self.assertEqual(self.client.get(
+                    url, HTTP_IF_NONE_MATCH=etag
+                ).status_code, 200)
@@ -2,7 +2,7 @@ from django.urls import include, path
 from rest_framework import routers
 
 from api.views import (IngredientViewSet, MyUserViewSet, RecipeViewSet,
-                       TagViewSet)
+                       TagViewSet, database_metrics, request_metrics)
 
 router_v1 = routers.DefaultRouter()
 router_v1.register('recipes', RecipeViewSet, basename='recipe')
@@ -13,4 +13,6 @@ router_v1.register('users', MyUserViewSet, basename='user')
 urlpatterns = [
     path('', include(router_v1.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path('internal/db/', database_metrics, name='database_metrics'),
+    path('internal/metrics/', request_metrics, name='request_metrics'),
 ]
@@ -1,18 +1,29 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
-from rest_framework.decorators import action
-from rest_framework.pagination import LimitOffsetPagination
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from foodgram import db, metrics
+from recipes.counters import change_counter
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Subscription, Tag)
+                            ShoppingCart, ShoppingCartIngredient, Subscription,
+                            Tag, TimelineEntry)
 
-from .actions import download_file
+from .actions import (FILE_FORMATS, attach_recipe_previews, download_file,
+                      get_recipes_limit)
+from .catalog import get_catalog
+from .context import get_viewer_context
 from .filters import IngredientFilter, UserRecipeFilter
+from .mixins import ConditionalGetMixin
+from .pagination import (RecipePagination, TimelinePagination,
+                         TrendingPagination, UserPagination)
 from .permissions import IsAuthorAdminOrReadOnly, ReadOnly
 from .serializers import (IngredientSerializer, MyUserSerializer,
                           RecipeSerializer, RecipeSerializerGet, RecipeUser,
@@ -21,10 +32,20 @@ from .serializers import (IngredientSerializer, MyUserSerializer,
 User = get_user_model()
 
 
+def created_status(created):
+    return status.HTTP_201_CREATED if created else status.HTTP_200_OK
+
+
 class MyUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = MyUserSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = UserPagination
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # Recipes are taken off shopping lists while the delete is
+        # collected, so both run in one transaction.
+        instance.delete()
 
     @action(
         methods=['post', 'delete'],
@@ -45,22 +66,30 @@ class MyUserViewSet(UserViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         if request.method == 'POST':
-            subscription = Subscription.objects.create(
-                user=user,
-                author=author
-            )
+            with transaction.atomic():
+                created = Subscription.objects.add(
+                    user=user,
+                    author=author
+                )
+                if created:
+                    TimelineEntry.objects.follow(user, author)
+                    change_counter(author, 'subscribers_count', 1)
             serializer = SubscriptionSerializer(
-                subscription.author,
+                author,
                 context={'request': request}
             )
             return Response(
                 serializer.data,
-                status=status.HTTP_201_CREATED
+                status=created_status(created)
             )
-        Subscription.objects.filter(
-            user=user,
-            author=author
-        ).delete()
+        with transaction.atomic():
+            deleted, _ = Subscription.objects.filter(
+                user=user,
+                author=author
+            ).delete()
+            if deleted:
+                TimelineEntry.objects.unfollow(user, author)
+            change_counter(author, 'subscribers_count', -deleted)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -72,22 +101,20 @@ class MyUserViewSet(UserViewSet):
         serializer_class=MyUserSerializer
     )
     def subscriptions(self, request):
-        user = request.user
-        user = get_object_or_404(
-            User,
-            id=user.id
-        )
-        queryset = [i.author for i in user.subscriber.all()]
+        queryset = User.objects.filter(
+            on_subscribe__user=request.user
+        ).order_by('id')
+        recipes_limit = get_recipes_limit(request)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = SubscriptionSerializer(
-                page,
+                attach_recipe_previews(page, recipes_limit),
                 many=True,
                 context={'request': request},
             )
             return self.get_paginated_response(serializer.data)
         serializer = SubscriptionSerializer(
-            queryset,
+            attach_recipe_previews(queryset, recipes_limit),
             many=True,
             context={'request': request},
         )
@@ -97,18 +124,91 @@ class MyUserViewSet(UserViewSet):
         )
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
     filter_class = UserRecipeFilter
     permission_classes = (IsAuthorAdminOrReadOnly,)
+    conditional_actions = ('retrieve',)
+
+    def get_version_names(self):
+        try:
+            self.recipe_pk, self.author_id = Recipe.objects.values_list(
+                'id', 'author_id'
+            ).get(pk=self.kwargs['pk'])
+        except (Recipe.DoesNotExist, ValueError):
+            raise Http404
+        return (
+            f'recipe:{self.recipe_pk}',
+            f'user:{self.author_id}',
+            'tags',
+            'ingredients'
+        )
+
+    def get_etag_parts(self):
+        viewer = get_viewer_context(self.request)
+        return (
+            self.request.user.pk,
+            self.recipe_pk in viewer.favorite_ids,
+            self.recipe_pk in viewer.cart_ids,
+            self.author_id in viewer.subscribed_ids
+        )
+
+    def get_queryset(self):
+        return Recipe.objects.select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeSerializerGet
         return RecipeSerializer
 
+    @action(
+        methods=['get'],
+        detail=False,
+        url_path='feed',
+        url_name='feed',
+        permission_classes=(IsAuthenticated,),
+        pagination_class=TimelinePagination
+    )
+    def feed(self, request):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['get'],
+        detail=False,
+        url_path='trending',
+        url_name='trending',
+        pagination_class=TrendingPagination
+    )
+    def trending(self, request):
+        queryset = self.filter_queryset(
+            self.get_queryset().filter(
+                rank__isnull=False
+            ).annotate(
+                position=F('rank__position')
+            ).order_by('position')
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(
+            serializer.data,
+            status=status.HTTP_200_OK
+        )
+
     @action(
         methods=['post', 'delete'],
         detail=True,
@@ -123,22 +223,27 @@ class RecipeViewSet(viewsets.ModelViewSet):
             id=self.kwargs.get('pk')
         )
         if request.method == 'POST':
-            favorite = Favorite.objects.create(
-                user=user,
-                recipes=recipe
-            )
+            with transaction.atomic():
+                created = Favorite.objects.add(
+                    user=user,
+                    recipes=recipe
+                )
+                if created:
+                    change_counter(recipe, 'favorites_count', 1)
             serializer = RecipeUser(
-                favorite.recipes,
+                recipe,
                 context={'request': request}
             )
             return Response(
                 serializer.data,
-                status=status.HTTP_201_CREATED
+                status=created_status(created)
             )
-        Favorite.objects.filter(
-            user=user,
-            recipes=recipe
-        ).delete()
+        with transaction.atomic():
+            deleted, _ = Favorite.objects.filter(
+                user=user,
+                recipes=recipe
+            ).delete()
+            change_counter(recipe, 'favorites_count', -deleted)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -155,22 +260,30 @@ class RecipeViewSet(viewsets.ModelViewSet):
             id=self.kwargs.get('pk')
         )
         if request.method == 'POST':
-            cart = ShoppingCart.objects.create(
-                user=user,
-                recipes=recipe
-            )
+            with transaction.atomic():
+                created = ShoppingCart.objects.add(
+                    user=user,
+                    recipes=recipe
+                )
+                if created:
+                    ShoppingCartIngredient.objects.add_recipe(user, recipe)
             serializer = RecipeUser(
-                cart.recipes,
+                recipe,
                 context={'request': request}
             )
             return Response(
                 serializer.data,
-                status=status.HTTP_201_CREATED
+                status=created_status(created)
             )
-        ShoppingCart.objects.filter(
-            user=user,
-            recipes=recipe
-        ).delete()
+        with transaction.atomic():
+            deleted, _ = ShoppingCart.objects.filter(
+                user=user,
+                recipes=recipe
+            ).delete()
+            if deleted:
+                ShoppingCartIngredient.objects.remove_recipe(
+                    user, recipe, deleted
+                )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -182,26 +295,94 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def download_shopping_cart(self, request):
         user = request.user
-        shopping_cart = RecipeIngredient.objects.filter(
-            recipe__shopping_cart__user=user
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in FILE_FORMATS:
+            return Response(
+                'Неподдерживаемый формат файла!',
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        shopping_cart = ShoppingCartIngredient.objects.filter(
+            user=user
         ).values(
             'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        return download_file(shopping_cart)
+            'ingredient__measurement_unit',
+            'amount'
+        ).order_by('ingredient__name')
+        return download_file(shopping_cart, file_format)
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        TimelineEntry.objects.fan_out(recipe)
+        change_counter(self.request.user, 'recipes_count', 1)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        change_counter(instance.author, 'recipes_count', -1)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (ReadOnly,)
+    version_names = ('tags',)
+    cache_responses = True
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (ReadOnly,)
     filter_class = IngredientFilter
+    version_names = ('ingredients',)
+
+    def list(self, request, *args, **kwargs):
+        if not settings.INGREDIENT_CATALOG_TTL:
+            return super().list(request, *args, **kwargs)
+        return self.conditional(self.list_from_catalog, request)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.INGREDIENT_CATALOG_TTL:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional(self.retrieve_from_catalog, request, **kwargs)
+
+    def list_from_catalog(self, request):
+        name = request.query_params.get('name')
+        catalog = get_catalog(*self.versions)
+        return Response(catalog.search(name) if name else catalog.all())
+
+    def retrieve_from_catalog(self, request, **kwargs):
+        catalog = get_catalog(*self.versions)
+        try:
+            ingredient = catalog.get(int(kwargs['pk']))
+        except ValueError:
+            ingredient = None
+        if ingredient is None:
+            raise Http404
+        return Response(ingredient)
+
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+def database_metrics(request):
+    """Connection metrics of the worker process serving the request."""
+    snapshot = db.snapshot()
+    snapshot['settings'] = {
+        alias: {
+            'engine': options['ENGINE'],
+            'conn_max_age': options['CONN_MAX_AGE'],
+            'conn_health_checks': options.get('CONN_HEALTH_CHECKS', False),
+        } for alias, options in settings.DATABASES.items()
+    }
+    return Response(snapshot, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+def request_metrics(request):
+    """Request histograms of this worker in the Prometheus text format."""
+    return HttpResponse(
+        metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -0,0 +1,106 @@
+"""Database backends with connection health checks and metrics.
+
+``foodgram.db.postgresql`` and ``foodgram.db.sqlite3`` wrap the Django
+backends of the same name. Persistent connections (``CONN_MAX_AGE``) are
+pinged once per request before reuse when ``CONN_HEALTH_CHECKS`` is set,
+and every worker process counts opened, reused and dropped connections
+and the time spent connecting.
+"""
+import os
+import threading
+import time
+import weakref
+
+_lock = threading.Lock()
+_stats = {}
+_open = weakref.WeakSet()
+
+
+def _alias_stats(alias):
+    return _stats.setdefault(alias, {
+        'opened': 0,
+        'closed': 0,
+        'reused': 0,
+        'health_check_failures': 0,
+        'connect_seconds_total': 0.0,
+        'connect_seconds_max': 0.0,
+    })
+
+
+def record(alias, **increments):
+    with _lock:
+        stats = _alias_stats(alias)
+        for name, value in increments.items():
+            stats[name] += value
+
+
+def record_connect(alias, seconds):
+    with _lock:
+        stats = _alias_stats(alias)
+        stats['opened'] += 1
+        stats['connect_seconds_total'] += seconds
+        stats['connect_seconds_max'] = max(
+            stats['connect_seconds_max'], seconds
+        )
+
+
+def snapshot():
+    """Metrics of the current worker process."""
+    now = time.monotonic()
+    with _lock:
+        aliases = {alias: dict(stats) for alias, stats in _stats.items()}
+        connections = list(_open)
+    for alias, stats in aliases.items():
+        ages = [
+            now - wrapper.connected_at for wrapper in connections
+            if wrapper.alias == alias and wrapper.connection is not None
+        ]
+        stats['open'] = len(ages)
+        stats['age_seconds_max'] = max(ages, default=0.0)
+        stats['connect_seconds_avg'] = (
+            stats['connect_seconds_total'] / stats['opened']
+            if stats['opened'] else 0.0
+        )
+    return {'pid': os.getpid(), 'databases': aliases}
+
+
+class InstrumentedDatabaseWrapperMixin:
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connected_at = None
+        self.request_checked = True
+
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        self.connected_at = time.monotonic()
+        self.request_checked = True
+        record_connect(self.alias, self.connected_at - started)
+        with _lock:
+            _open.add(self)
+
+    def close(self):
+        if self.connection is not None:
+            record(self.alias, closed=1)
+        super().close()
+
+    def close_if_unusable_or_obsolete(self):
+        # Runs on request_started and request_finished; the check itself
+        # goes through ensure_connection() and must not count as a use.
+        self.request_checked = True
+        super().close_if_unusable_or_obsolete()
+        self.request_checked = False
+
+    def ensure_connection(self):
+        if self.connection is not None and not self.request_checked:
+            self.request_checked = True
+            if (
+                self.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not self.is_usable()
+            ):
+                record(self.alias, health_check_failures=1)
+                self.close()
+            else:
+                record(self.alias, reused=1)
+        super().ensure_connection()
@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from foodgram.db import InstrumentedDatabaseWrapperMixin
+
+
+class DatabaseWrapper(InstrumentedDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,225 @@
+"""Per-route request latency, SQL query count and SQL time.
+
+``RequestMetricsMiddleware`` records every request into histograms kept
+by the worker process; ``render`` exports them in the Prometheus text
+format. ``query_budget`` fails a block of code running more queries
+than allowed; the ``check_query_budgets`` command holds every budgeted
+route to ``QUERY_BUDGETS``.
+"""
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Most queries a request to the route may run, by URL name, counting
+# one for the token lookup on a cold authentication cache and one for the
+# versions of conditional GET routes. Requests above the budget are
+# counted in foodgram_query_budget_exceeded_total.
+QUERY_BUDGETS = {
+    'recipe-list': 8,
+    'recipe-detail': 9,
+    'recipe-feed': 9,
+    'recipe-trending': 8,
+    'recipe-favorite': 8,
+    'recipe-shopping_cart': 13,
+    'recipe-download_shopping_cart': 2,
+    'tag-list': 3,
+    'ingredient-list': 3,
+    'user-list': 4,
+    'user-me': 2,
+    'user-subscriptions': 5,
+    'user-subscribe': 12,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, values in series:
+            lines.extend(self.samples(labels, values))
+        return lines
+
+    def sample(self, suffix, labels, value):
+        pairs = ','.join(
+            f'{name}="{escape(label)}"' for name, label in labels
+        )
+        return f'{self.name}{suffix}{{{pairs}}} {value}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def samples(self, labels, value):
+        return [self.sample('', labels, value)]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0.0,
+                    'count': 0,
+                }
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self, labels, values):
+        lines = [
+            self.sample('_bucket', labels + (('le', bound),), total)
+            for bound, total in zip(self.buckets, values['buckets'])
+        ]
+        lines.append(self.sample(
+            '_bucket', labels + (('le', '+Inf'),), values['count']
+        ))
+        lines.append(self.sample('_sum', labels, values['sum']))
+        lines.append(self.sample('_count', labels, values['count']))
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n'
+    )
+
+
+REQUEST_SECONDS = Histogram(
+    'foodgram_request_duration_seconds',
+    'Time spent serving the request.',
+    LATENCY_BUCKETS
+)
+REQUEST_QUERIES = Histogram(
+    'foodgram_request_queries',
+    'SQL queries run while serving the request.',
+    QUERY_BUCKETS
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'foodgram_request_sql_duration_seconds',
+    'Time spent in SQL queries while serving the request.',
+    LATENCY_BUCKETS
+)
+BUDGET_EXCEEDED = Counter(
+    'foodgram_query_budget_exceeded_total',
+    'Requests that ran more queries than the budget of their route.'
+)
+METRICS = (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_SQL_SECONDS,
+           BUDGET_EXCEEDED)
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+
+@contextmanager
+def query_budget(limit, name='block'):
+    """Raise QueryBudgetExceeded if the block runs over ``limit`` queries.
+
+        with query_budget(QUERY_BUDGETS['recipe-list'], 'recipe-list'):
+            client.get('/api/recipes/')
+    """
+    with count_queries() as counter:
+        yield counter
+    if counter.queries > limit:
+        raise QueryBudgetExceeded(
+            f'{name}: {counter.queries} queries, budget is {limit}'
+        )
+
+
+class RequestMetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            counter = stack.enter_context(count_queries())
+            response = self.get_response(request)
+            if response.streaming:
+                # The body runs its queries while the server iterates it,
+                # so counting goes on until the response is closed.
+                counting = stack.pop_all()
+
+                def close():
+                    counting.close()
+                    self.observe(request, started, counter)
+
+                response._resource_closers.append(close)
+                return response
+        self.observe(request, started, counter)
+        return response
+
+    def observe(self, request, started, counter):
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+        REQUEST_SECONDS.observe(labels, time.perf_counter() - started)
+        REQUEST_QUERIES.observe(labels, counter.queries)
+        REQUEST_SQL_SECONDS.observe(labels, counter.seconds)
+        if counter.queries > QUERY_BUDGETS.get(route, float('inf')):
+            BUDGET_EXCEEDED.inc(labels)
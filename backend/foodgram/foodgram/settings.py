@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'users.MyUser'
 
 MIDDLEWARE = [
+    'foodgram.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,14 +70,29 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 # Database
 
+# Backends that add health checks and connection metrics on top of the
+# Django ones, see foodgram.db.
+INSTRUMENTED_DB_ENGINES = {
+    'django.db.backends.postgresql': 'foodgram.db.postgresql',
+    'django.db.backends.sqlite3': 'foodgram.db.sqlite3',
+}
+DB_ENGINE = os.getenv('DB_ENGINE', default='django.db.backends.postgresql')
+
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE', default='django.db.backends.postgresql'),
+        'ENGINE': INSTRUMENTED_DB_ENGINES.get(DB_ENGINE, DB_ENGINE),
         'NAME': os.getenv('POSTGRES_DB', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('POSTGRES_HOST', default='db'),
         'PORT': os.getenv('POSTGRES_PORT', default='5432'),
+        # Seconds a connection is kept between requests; 0 closes it
+        # after each request.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', default='true').lower()
+            == 'true'
+        ),
     }
 }
 
@@ -126,7 +142,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -148,3 +164,36 @@ DJOSER = {
 }
 
 EMPTY_CONST = '-пусто-'
+
+RECIPES_LIMIT_MAX = int(os.getenv('RECIPES_LIMIT_MAX', default=20))
+
+# Seconds an in-memory ingredient catalog may be served without a reload;
+# 0 serves ingredients from the database.
+INGREDIENT_CATALOG_TTL = int(os.getenv('INGREDIENT_CATALOG_TTL', default=300))
+
+# Seconds a worker reuses the ETag versions it read from the database;
+# changes made by other workers are seen after at most this long.
+VERSION_CACHE_TTL = int(os.getenv('VERSION_CACHE_TTL', default=2))
+
+# Trending recipes: favorites and cart additions over the last days.
+TRENDING_WINDOW_DAYS = int(os.getenv('TRENDING_WINDOW_DAYS', default=7))
+TRENDING_SIZE = int(os.getenv('TRENDING_SIZE', default=1000))
+
+# Authors with more subscribers are merged into feeds on read
+# instead of being copied into every subscriber's timeline.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', default=10000))
+
+# Recipe image variants are made by a pool of IMAGE_WORKERS processes
+# after the upload is stored; 0 makes them inside the request.
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+IMAGE_VARIANT_FORMAT = os.getenv('IMAGE_VARIANT_FORMAT', default='WEBP')
+# Uploads with more pixels are rejected before anything is decoded.
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', default=40_000_000))
+
+# Token -> user lookups are cached per worker for AUTH_TOKEN_CACHE_TTL
+# seconds, and in the default cache too with AUTH_TOKEN_CACHE_SHARED.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', default=10000))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', default=60))
+AUTH_TOKEN_CACHE_SHARED = (
+    os.getenv('AUTH_TOKEN_CACHE_SHARED', default='false').lower() == 'true'
+)
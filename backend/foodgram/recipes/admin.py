@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db import transaction
 
 from foodgram.settings import EMPTY_CONST
 
@@ -22,6 +23,10 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'author')
     empty_value_display = EMPTY_CONST
 
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
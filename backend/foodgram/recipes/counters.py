@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Favorite, Recipe, Subscription
+from .versions import bump_version
+
+User = get_user_model()
+
+# (model, counter, counted model, its foreign key to model)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipes'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+RECOUNT_BATCH = 1000
+
+
+def actual_count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('id')).values('total')
+    ), 0)
+
+
+def change_counter(obj, counter, delta):
+    # Rows added or deleted elsewhere (the admin) are not counted, so the
+    # counter is kept from going below zero. update() sends no post_save,
+    # so the version of the row (recipe:<id>, user:<id>) is bumped here.
+    if delta:
+        type(obj).objects.filter(pk=obj.pk).update(
+            **{counter: Greatest(F(counter) + delta, 0)}
+        )
+        name = f'{obj._meta.model_name}:{obj.pk}'
+        transaction.on_commit(lambda: bump_version(name))
+
+
+def recount(related, objects):
+    """Recompute the counters of the rows ``objects`` (``related``
+    instances) point to."""
+    for model, counter, counted, field in COUNTERS:
+        if counted is not related:
+            continue
+        attname = related._meta.get_field(field).attname
+        pks = sorted({getattr(obj, attname) for obj in objects})
+        for start in range(0, len(pks), RECOUNT_BATCH):
+            model.objects.filter(
+                pk__in=pks[start:start + RECOUNT_BATCH]
+            ).update(**{counter: actual_count(related, field)})
@@ -0,0 +1,234 @@
+"""Reproducible fake data for benchmarks and load tests.
+
+Everything is drawn from ``random.Random(seed)`` and inserted with
+``bulk_create`` in batches; rows are named with ``prefix`` so they can
+be told apart from real ones. Authors, followed authors, favorite
+recipes and ingredients are picked with Zipf weights of exponent
+``skew`` (0 is uniform), so a few of them get most of the activity.
+Derived data (counters, shopping lists, timelines and the trending
+ranking) is rebuilt at the end.
+"""
+import random
+import time
+from collections import namedtuple
+from io import StringIO
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import transaction
+
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                     ShoppingCart, ShoppingCartIngredient, Subscription, Tag,
+                     TimelineEntry)
+from .versions import bump_version
+
+User = get_user_model()
+
+# favorites, carts and subscriptions are averages per user; the first
+# user, the benchmark viewer, follows viewer_subscriptions authors.
+# ingredients=0 uses the ingredients already in the database.
+Scale = namedtuple('Scale', (
+    'users',
+    'ingredients',
+    'recipes',
+    'favorites',
+    'carts',
+    'subscriptions',
+    'viewer_subscriptions',
+))
+SCALES = {
+    'small': Scale(
+        users=50, ingredients=2000, recipes=500,
+        favorites=5, carts=3, subscriptions=5, viewer_subscriptions=20
+    ),
+    'medium': Scale(
+        users=1000, ingredients=20000, recipes=5000,
+        favorites=10, carts=3, subscriptions=10, viewer_subscriptions=200
+    ),
+    'large': Scale(
+        users=10000, ingredients=100000, recipes=20000,
+        favorites=10, carts=3, subscriptions=10, viewer_subscriptions=9999
+    ),
+    'huge': Scale(
+        users=200000, ingredients=0, recipes=1000000,
+        favorites=20, carts=5, subscriptions=20, viewer_subscriptions=100
+    ),
+}
+TAGS = (
+    ('Завтрак', 'breakfast', '#E26C2D'),
+    ('Обед', 'lunch', '#49B64E'),
+    ('Ужин', 'dinner', '#8775D2'),
+)
+INGREDIENTS_PER_RECIPE = (5, 20)
+PASSWORD = 'fake-password'
+
+
+class FakeData:
+
+    def __init__(self, scale, seed=0, batch_size=1000, prefix='fake',
+                 skew=1.0, progress=None):
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.skew = skew
+        # progress(model, rows, seconds, done) is called after each batch.
+        self.progress = progress or (lambda *args: None)
+
+    def insert(self, model, objects):
+        objects = iter(objects)
+        started = time.monotonic()
+        rows = 0
+        batch = list(islice(objects, self.batch_size))
+        while batch:
+            model.objects.bulk_create(batch)
+            rows += len(batch)
+            self.progress(model, rows, time.monotonic() - started, False)
+            batch = list(islice(objects, self.batch_size))
+        self.progress(model, rows, time.monotonic() - started, True)
+
+    @transaction.atomic
+    def generate(self):
+        self.tags = self.make_tags()
+        self.users = self.make_users()
+        self.ingredients = self.make_ingredients()
+        self.recipes = self.make_recipes()
+        self.make_recipe_ingredients()
+        self.make_recipe_tags()
+        self.make_relations(Favorite, 'recipes_id', self.scale.favorites)
+        self.make_relations(ShoppingCart, 'recipes_id', self.scale.carts)
+        self.make_subscriptions()
+        self.rebuild()
+        return User.objects.get(pk=self.users[0])
+
+    def popularity(self, population):
+        population = list(population)
+        self.rng.shuffle(population)
+        weights = accumulate(
+            1 / rank ** self.skew for rank in range(1, len(population) + 1)
+        )
+        return population, list(weights)
+
+    def pick(self, popular, size):
+        # Duplicates are dropped, so popular items make samples smaller.
+        population, weights = popular
+        return set(self.rng.choices(population, cum_weights=weights, k=size))
+
+    def make_tags(self):
+        for name, slug, color in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def make_users(self):
+        password = make_password(PASSWORD)
+        self.insert(User, (
+            User(
+                username=f'{self.prefix}{index}',
+                email=f'{self.prefix}{index}@example.com',
+                first_name='Fake',
+                last_name=str(index),
+                password=password
+            ) for index in range(self.scale.users)
+        ))
+        return list(User.objects.filter(
+            username__startswith=self.prefix
+        ).order_by('id').values_list('id', flat=True))
+
+    def make_ingredients(self):
+        if not self.scale.ingredients:
+            return list(
+                Ingredient.objects.order_by('id').values_list('id', flat=True)
+            )
+        self.insert(Ingredient, (
+            Ingredient(
+                name=f'{self.prefix} ингредиент {index}',
+                measurement_unit=self.rng.choice(('г', 'мл', 'шт.'))
+            ) for index in range(self.scale.ingredients)
+        ))
+        return list(Ingredient.objects.filter(
+            name__startswith=f'{self.prefix} '
+        ).order_by('id').values_list('id', flat=True))
+
+    def make_recipes(self):
+        authors, weights = self.popularity(self.users)
+        self.insert(Recipe, (
+            Recipe(
+                author_id=author_id,
+                name=f'{self.prefix} рецепт {index}',
+                text='Описание рецепта',
+                cooking_time=self.rng.randint(1, 180)
+            ) for index, author_id in enumerate(self.rng.choices(
+                authors, cum_weights=weights, k=self.scale.recipes
+            ))
+        ))
+        return list(Recipe.objects.filter(
+            name__startswith=f'{self.prefix} '
+        ).order_by('id').values_list('id', flat=True))
+
+    def make_recipe_ingredients(self):
+        ingredients = self.popularity(self.ingredients)
+        self.insert(RecipeIngredient, (
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=self.rng.randint(1, 500)
+            )
+            for recipe_id in self.recipes
+            for ingredient_id in sorted(self.pick(
+                ingredients, self.rng.randint(*INGREDIENTS_PER_RECIPE)
+            ))
+        ))
+
+    def make_recipe_tags(self):
+        self.insert(RecipeTag, (
+            RecipeTag(recipe_id=recipe_id, tags_id=tag_id)
+            for recipe_id in self.recipes
+            for tag_id in self.rng.sample(
+                self.tags, self.rng.randint(1, len(self.tags))
+            )
+        ))
+
+    def make_relations(self, model, field, average):
+        recipes = self.popularity(self.recipes)
+        self.insert(model, (
+            model(user_id=user_id, **{field: recipe_id})
+            for user_id in self.users
+            for recipe_id in sorted(self.pick(
+                recipes, self.rng.randint(0, 2 * average)
+            ))
+        ))
+
+    def make_subscriptions(self):
+        self.insert(Subscription, (
+            Subscription(user_id=user_id, author_id=author_id)
+            for user_id, authors in self.follows()
+            for author_id in authors
+            if author_id != user_id
+        ))
+
+    def follows(self):
+        viewer, *others = self.users
+        yield viewer, self.rng.sample(
+            others, min(self.scale.viewer_subscriptions, len(others))
+        )
+        authors = self.popularity(self.users)
+        for user_id in others:
+            yield user_id, sorted(self.pick(
+                authors, self.rng.randint(0, 2 * self.scale.subscriptions)
+            ))
+
+    def rebuild(self):
+        users = User.objects.filter(
+            username__startswith=self.prefix
+        ).values('id')
+        call_command('reconcile_counters', stdout=StringIO())
+        ShoppingCartIngredient.objects.rebuild(users)
+        TimelineEntry.objects.rebuild(users)
+        call_command('refresh_trending', '--full', stdout=StringIO())
+        # bulk_create sends no signals.
+        transaction.on_commit(lambda: bump_version('tags'))
+        transaction.on_commit(lambda: bump_version('ingredients'))
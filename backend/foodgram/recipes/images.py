@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from . import workers
+from .models import Recipe
+from .versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+# Recipe field -> longest side of the variant in pixels.
+VARIANTS = {
+    'image_thumbnail': 320,
+    'image_medium': 960,
+}
+FORMATS = {
+    'WEBP': ('webp', {'quality': 80, 'method': 4}),
+    'JPEG': ('jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor(broken=None):
+    global _executor
+    with _lock:
+        if _executor is None or _executor is broken:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=workers.init_worker,
+                initargs=(os.environ['DJANGO_SETTINGS_MODULE'],)
+            )
+        return _executor
+
+
+def render(image, size, image_format):
+    variant = image.copy()
+    variant.thumbnail((size, size), Image.LANCZOS)
+    extension, options = FORMATS[image_format]
+    if image_format == 'JPEG' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    buffer = BytesIO()
+    variant.save(buffer, image_format, **options)
+    return extension, buffer.getvalue()
+
+
+def make_variants(recipe_id):
+    """Write the resized variants of a recipe image; True if stored.
+
+    Runs in a worker process. The row is only updated if the recipe
+    still has the image the variants were made from.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return False
+    name = recipe.image.name
+    stem = os.path.splitext(os.path.basename(name))[0]
+    image_format = settings.IMAGE_VARIANT_FORMAT
+    variants = {}
+    with recipe.image.open('rb') as file, Image.open(file) as image:
+        image.draft('RGB', (max(VARIANTS.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for field, size in VARIANTS.items():
+            extension, content = render(image, size, image_format)
+            upload_to = Recipe._meta.get_field(field).upload_to
+            variants[field] = default_storage.save(
+                f'{upload_to}{stem}.{extension}', ContentFile(content)
+            )
+    if not Recipe.objects.filter(pk=recipe_id, image=name).update(
+        **variants
+    ):
+        return False
+    bump_version(f'recipe:{recipe_id}')
+    return True
+
+
+def variants_failed(recipe_id, future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(
+            'Image variants of recipe %s failed', recipe_id,
+            exc_info=future.exception()
+        )
+
+
+def process_image(recipe_id):
+    """Make the variants after the current transaction commits.
+
+    With ``IMAGE_WORKERS`` = 0 they are made in the calling process.
+    Failures are logged: the recipe keeps serving its original image.
+    """
+    def submit():
+        if not settings.IMAGE_WORKERS:
+            try:
+                make_variants(recipe_id)
+            except Exception:
+                logger.exception(
+                    'Image variants of recipe %s failed', recipe_id
+                )
+            return
+        executor = get_executor()
+        try:
+            future = executor.submit(workers.make_variants, recipe_id)
+        except BrokenProcessPool:
+            future = get_executor(broken=executor).submit(
+                workers.make_variants, recipe_id
+            )
+        future.add_done_callback(partial(variants_failed, recipe_id))
+
+    transaction.on_commit(submit)
@@ -0,0 +1,321 @@
+import json
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from django import get_version
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from foodgram.metrics import count_queries
+from recipes.fake_data import SCALES, TAGS, FakeData
+from recipes.models import TimelineEntry
+
+# p95 changes smaller than this are noise whatever the threshold.
+MIN_DELTA_MS = 1.0
+GIF = (
+    'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEA'
+    'AAIBRAA7'
+)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1,
+                       round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed fake data at each scale inside a transaction that is rolled '
+        'back, then measure p50/p95 latency and SQL queries of the API '
+        'endpoints through the Django test client. Results are written as '
+        'JSON; --compare flags regressions against an earlier run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales',
+            default='small,medium',
+            help=f'Comma separated scales out of {", ".join(SCALES)}.'
+        )
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output',
+            help='Write the results to this JSON file.'
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON results of an earlier run to compare with.'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Relative p95 growth reported as a regression.'
+        )
+
+    def handle(self, *args, **options):
+        names = options['scales'].split(',')
+        unknown = set(names) - set(SCALES)
+        if unknown:
+            raise CommandError(f'Неизвестный масштаб: {", ".join(unknown)}')
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'date': datetime.now(timezone.utc).isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': get_version(),
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+            },
+            'scales': {},
+        }
+        for name in names:
+            self.stdout.write(f'Scale {name}: {SCALES[name]}')
+            results['scales'][name] = self.run_scale(name, options)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = self.compare(
+                baseline, results, options['threshold']
+            )
+            if regressions:
+                raise CommandError(f'{regressions} regressions')
+
+    def run_scale(self, name, options):
+        # Every scale starts with an empty private cache, uploaded images
+        # go to a scratch MEDIA_ROOT and the rows are rolled back.
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': f'benchmark-{name}',
+        }}
+        scale = SCALES[name]
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root, CACHES=caches):
+                with transaction.atomic():
+                    endpoints = self.measure_scale(scale, options)
+                    transaction.set_rollback(True)
+        return {'scale': scale._asdict(), 'endpoints': endpoints}
+
+    def measure_scale(self, scale, options):
+        started = time.monotonic()
+        data = FakeData(scale, seed=options['seed'], prefix='benchmark')
+        viewer = data.generate()
+        self.stdout.write(f'  seeded in {time.monotonic() - started:.1f}s')
+        client = APIClient()
+        client.force_authenticate(user=viewer)
+        endpoints = {}
+        cases = self.endpoints(client, data, viewer)
+        for name, requests, overrides, *prepare in cases:
+            # A case with a prepare step runs in a savepoint rolled back
+            # before the next case.
+            with override_settings(**overrides), transaction.atomic():
+                for step in prepare:
+                    step()
+                result = endpoints[name] = self.measure(
+                    client, requests, options['repeat'], options['warmup']
+                )
+                transaction.set_rollback(bool(prepare))
+            self.stdout.write(
+                f'  {name:36} p50 {result["p50_ms"]:8.2f} ms'
+                f'  p95 {result["p95_ms"]:8.2f} ms'
+                f'  {result["queries"]:4} queries'
+            )
+        return endpoints
+
+    def endpoints(self, client, data, viewer):
+        recipe = client.get('/api/recipes/', {'limit': 1}).data['results'][0]
+        excluded = set(
+            viewer.favorite.values_list('recipes_id', flat=True)
+        ).union(viewer.shopping_cart.values_list('recipes_id', flat=True))
+        other = next(pk for pk in data.recipes if pk not in excluded)
+        excluded = set(viewer.subscriber.values_list('author_id', flat=True))
+        author = next(
+            pk for pk in data.users[1:] if pk not in excluded
+        )
+        recipe_body = {
+            'ingredients': [
+                {'id': item['id'], 'amount': item['amount']}
+                for item in recipe['ingredients']
+            ],
+            'tags': [tag['id'] for tag in recipe['tags']],
+            'name': 'Бенчмарк',
+            'text': 'Бенчмарк',
+            'cooking_time': 10,
+            'image': GIF,
+        }
+        own = client.post('/api/recipes/', recipe_body, format='json')
+        patch_body = dict(recipe_body)
+        patch_body.pop('image')
+        no_fanout = {'FEED_FANOUT_LIMIT': -1}
+
+        def empty_timeline():
+            # Fan-out on read merges no copied rows: every author is read.
+            TimelineEntry.objects.filter(user=viewer).delete()
+
+        return (
+            ('recipes list', [
+                ('get', '/api/recipes/', {'limit': 6}),
+            ], {}),
+            ('recipes list deep page', [
+                ('get', '/api/recipes/', {
+                    'limit': 6, 'offset': len(data.recipes) // 2
+                }),
+            ], {}),
+            ('recipes list cursor', [
+                ('get', '/api/recipes/', {'limit': 6, 'cursor': ''}),
+            ], {}),
+            ('recipes list filtered', [
+                ('get', '/api/recipes/', {
+                    'limit': 6, 'tags': TAGS[0][1], 'is_favorited': 1
+                }),
+            ], {}),
+            ('recipe detail', [
+                ('get', f'/api/recipes/{recipe["id"]}/', None),
+            ], {}),
+            ('recipe create and delete', [
+                ('post', '/api/recipes/', recipe_body),
+                ('delete', '/api/recipes/{id}/', None),
+            ], {}),
+            ('recipe update', [
+                ('patch', f'/api/recipes/{own.data["id"]}/', patch_body),
+            ], {}),
+            ('feed fan-out on write', [
+                ('get', '/api/recipes/feed/', {'limit': 6}),
+            ], {}),
+            ('feed fan-out on read', [
+                ('get', '/api/recipes/feed/', {'limit': 6}),
+            ], no_fanout, empty_timeline),
+            ('recipe create, fan-out on write', [
+                ('post', '/api/recipes/', recipe_body),
+                ('delete', '/api/recipes/{id}/', None),
+            ], {}),
+            ('recipe create, fan-out on read', [
+                ('post', '/api/recipes/', recipe_body),
+                ('delete', '/api/recipes/{id}/', None),
+            ], no_fanout),
+            ('trending', [
+                ('get', '/api/recipes/trending/', {'limit': 6}),
+            ], {}),
+            ('favorite add and remove', [
+                ('post', f'/api/recipes/{other}/favorite/', None),
+                ('delete', f'/api/recipes/{other}/favorite/', None),
+            ], {}),
+            ('shopping cart add and remove', [
+                ('post', f'/api/recipes/{other}/shopping_cart/', None),
+                ('delete', f'/api/recipes/{other}/shopping_cart/', None),
+            ], {}),
+            ('download shopping cart', [
+                ('get', '/api/recipes/download_shopping_cart/', None),
+            ], {}),
+            ('users list', [
+                ('get', '/api/users/', {'limit': 6}),
+            ], {}),
+            ('user me', [
+                ('get', '/api/users/me/', None),
+            ], {}),
+            ('subscriptions', [
+                ('get', '/api/users/subscriptions/', {
+                    'limit': 6, 'recipes_limit': 3
+                }),
+            ], {}),
+            ('subscribe and unsubscribe', [
+                ('post', f'/api/users/{author}/subscribe/', None),
+                ('delete', f'/api/users/{author}/subscribe/', None),
+            ], {}),
+            ('ingredients search', [
+                ('get', '/api/ingredients/', {
+                    'name': f'{data.prefix} ингредиент 12'
+                }),
+            ], {}),
+            ('ingredients search, database', [
+                ('get', '/api/ingredients/', {
+                    'name': f'{data.prefix} ингредиент 12'
+                }),
+            ], {'INGREDIENT_CATALOG_TTL': 0}),
+            ('ingredient detail', [
+                ('get', f'/api/ingredients/{data.ingredients[0]}/', None),
+            ], {}),
+            ('tags list', [
+                ('get', '/api/tags/', None),
+            ], {}),
+        )
+
+    def measure(self, client, requests, repeat, warmup):
+        timings = []
+        queries = 0
+        for iteration in range(warmup + repeat):
+            created = {}
+            started = time.perf_counter()
+            with count_queries() as counter:
+                for method, url, data in requests:
+                    response = getattr(client, method)(
+                        url.format(**created), data, format='json'
+                    )
+                    if getattr(response, 'streaming', False):
+                        b''.join(response.streaming_content)
+                    if response.status_code >= 400:
+                        raise CommandError(
+                            f'{method.upper()} {url} returned '
+                            f'{response.status_code}: {response.content[:200]}'
+                        )
+                    if method == 'post' and url == '/api/recipes/':
+                        created['id'] = response.data['id']
+            elapsed = time.perf_counter() - started
+            if iteration >= warmup:
+                timings.append(elapsed * 1000)
+                queries = max(queries, counter.queries)
+        return {
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries': queries,
+        }
+
+    def compare(self, baseline, results, threshold):
+        regressions = 0
+        for scale, current in results['scales'].items():
+            previous = baseline.get('scales', {}).get(scale)
+            if previous is None:
+                continue
+            for name, metrics in current['endpoints'].items():
+                before = previous['endpoints'].get(name)
+                if before is None:
+                    continue
+                slower = metrics['p95_ms'] > max(
+                    before['p95_ms'] * (1 + threshold),
+                    before['p95_ms'] + MIN_DELTA_MS
+                )
+                more_queries = metrics['queries'] > before['queries']
+                if slower or more_queries:
+                    regressions += 1
+                    self.stdout.write(self.style.ERROR(
+                        f'{scale} {name}: p95 {before["p95_ms"]} -> '
+                        f'{metrics["p95_ms"]} ms, queries '
+                        f'{before["queries"]} -> {metrics["queries"]}'
+                    ))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+        return regressions
@@ -0,0 +1,143 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from foodgram.metrics import QUERY_BUDGETS, count_queries
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingCartIngredient, Subscription,
+                            Tag, TimelineEntry)
+from recipes.versions import get_versions
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every budgeted route on a small generated dataset and '
+        'fail if one runs more SQL queries than foodgram.metrics.'
+        'QUERY_BUDGETS allows, less the token lookup: requests are '
+        'force-authenticated. The data is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=30,
+            help='Number of generated recipes.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            results = self.measure(self.seed(options['recipes']))
+            transaction.set_rollback(True)
+        exceeded = []
+        for route, queries in results:
+            budget = QUERY_BUDGETS[route] - 1
+            status = 'ok' if queries <= budget else 'OVER BUDGET'
+            self.stdout.write(f'{route:32} {queries:3} / {budget:3} {status}')
+            if queries > budget:
+                exceeded.append(route)
+        if exceeded:
+            raise CommandError(
+                'Query budget exceeded: ' + ', '.join(exceeded)
+            )
+
+    def seed(self, recipes_number):
+        users = [
+            User.objects.create_user(
+                username=f'budget{index}',
+                email=f'budget{index}@example.com',
+                password='budget-password'
+            ) for index in range(6)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'budget{index}', slug=f'budget{index}', color='#000000'
+            ) for index in range(3)
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'budget{index}', measurement_unit='г')
+            for index in range(20)
+        )
+        ingredients = list(
+            Ingredient.objects.filter(name__startswith='budget')
+        )
+        for index in range(recipes_number):
+            recipe = Recipe.objects.create(
+                author=users[index % len(users)],
+                name=f'budget{index}',
+                text='budget',
+                cooking_time=index + 1
+            )
+            recipe.tags.set(tags[:index % len(tags) + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe,
+                    ingredient=ingredients[(index + shift) % len(ingredients)],
+                    amount=shift + 1
+                ) for shift in range(3)
+            )
+        viewer = users[0]
+        recipes = list(Recipe.objects.filter(name__startswith='budget'))
+        for author in users[1:4]:
+            Subscription.objects.create(user=viewer, author=author)
+        for recipe in recipes[:5]:
+            Favorite.objects.create(user=viewer, recipes=recipe)
+            ShoppingCart.objects.create(user=viewer, recipes=recipe)
+        ShoppingCartIngredient.objects.rebuild([viewer.id])
+        TimelineEntry.objects.rebuild([viewer.id])
+        call_command('refresh_trending', '--full', stdout=StringIO())
+        # Signals bump versions on commit, which never comes here.
+        recipe = recipes[-1]
+        get_versions([
+            f'recipe:{recipe.id}', f'user:{recipe.author_id}', 'tags',
+            'ingredients'
+        ])
+        return viewer, users[4], recipe
+
+    def measure(self, data):
+        viewer, author, recipe = data
+        client = APIClient()
+        client.force_authenticate(viewer)
+        requests = (
+            ('recipe-list', 'get', reverse('recipe-list'), {'limit': 10}),
+            ('recipe-detail', 'get',
+             reverse('recipe-detail', args=(recipe.id,)), None),
+            ('recipe-feed', 'get', reverse('recipe-feed'), {'limit': 10}),
+            ('recipe-trending', 'get', reverse('recipe-trending'),
+             {'limit': 10}),
+            ('recipe-favorite', 'post',
+             reverse('recipe-favorite', args=(recipe.id,)), None),
+            ('recipe-shopping_cart', 'post',
+             reverse('recipe-shopping_cart', args=(recipe.id,)), None),
+            ('recipe-download_shopping_cart', 'get',
+             reverse('recipe-download_shopping_cart'), None),
+            ('tag-list', 'get', reverse('tag-list'), None),
+            ('ingredient-list', 'get', reverse('ingredient-list'),
+             {'name': 'budget'}),
+            ('user-list', 'get', reverse('user-list'), {'limit': 10}),
+            ('user-me', 'get', reverse('user-me'), None),
+            ('user-subscriptions', 'get', reverse('user-subscriptions'),
+             {'limit': 10, 'recipes_limit': 3}),
+            ('user-subscribe', 'post',
+             reverse('user-subscribe', args=(author.id,)), None),
+        )
+        results = []
+        for route, method, url, data in requests:
+            with count_queries() as counter:
+                response = getattr(client, method)(url, data)
+                if getattr(response, 'streaming', False):
+                    b''.join(response.streaming_content)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{route}: {method.upper()} {url} returned '
+                    f'{response.status_code}'
+                )
+            results.append((route, counter.queries))
+        return results
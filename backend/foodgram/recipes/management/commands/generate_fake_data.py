@@ -0,0 +1,98 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.fake_data import PASSWORD, SCALES, FakeData
+from recipes.models import Ingredient
+
+User = get_user_model()
+
+# Seconds between progress lines of one table.
+PROGRESS_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate users, recipes with ingredients and tags, favorites, '
+        'shopping carts and subscriptions for load tests. The same seed '
+        'and scale give the same data. Authors, followed authors and '
+        'favorite recipes follow a power law of exponent --skew. '
+        f'Every fake user has the password "{PASSWORD}".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            choices=SCALES,
+            default='small',
+            help='Preset the options below are applied on.'
+        )
+        for name in SCALES['small']._fields:
+            parser.add_argument(
+                f'--{name.replace("_", "-")}',
+                type=int,
+                dest=name,
+                help=f'Override {name} of the scale.'
+            )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=1.0,
+            help='Power law exponent, 0 picks uniformly.'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--prefix',
+            default='fake',
+            help='Prefix of generated usernames, ingredients and recipes.'
+        )
+
+    def handle(self, *args, **options):
+        scale = SCALES[options['scale']]
+        scale = scale._replace(**{
+            name: options[name] for name in scale._fields
+            if options[name] is not None
+        })
+        if scale.users < 1:
+            raise CommandError('Нужен хотя бы один пользователь.')
+        if User.objects.filter(
+            username__startswith=options['prefix']
+        ).exists():
+            raise CommandError(
+                f'Пользователи с префиксом "{options["prefix"]}" уже есть, '
+                'укажите другой --prefix.'
+            )
+        if not scale.ingredients and not Ingredient.objects.exists():
+            raise CommandError(
+                'Ингредиентов нет: загрузите их через import_csv_data '
+                'или задайте --ingredients.'
+            )
+        self.reported = {}
+        data = FakeData(
+            scale,
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            prefix=options['prefix'],
+            skew=options['skew'],
+            progress=self.report
+        )
+        self.stdout.write(f'Generating {scale}')
+        started = time.monotonic()
+        viewer = data.generate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Done in {time.monotonic() - started:.1f}s; '
+            f'log in as {viewer.email} / {PASSWORD}'
+        ))
+
+    def report(self, model, rows, seconds, done):
+        last = self.reported.get(model, 0)
+        if not done and seconds - last < PROGRESS_INTERVAL:
+            return
+        self.reported[model] = seconds
+        line = (
+            f'{model.__name__}: {rows} rows in {seconds:.1f}s '
+            f'({rows / max(seconds, 1e-6):.0f} rows/s)'
+        )
+        self.stdout.write(self.style.SUCCESS(line) if done else line)
@@ -1,28 +1,326 @@
 import csv
+import io
+import json
 import os
+import time
+from collections import namedtuple
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
 
-from foodgram.settings import BASE_DIR
-from recipes.models import Ingredient
+from recipes.counters import recount
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, ShoppingCartIngredient,
+                            Subscription, Tag, TimelineEntry)
+from recipes.versions import bump_version
+from users.models import MyUser
+
+Spec = namedtuple('Spec', ('model', 'natural_key', 'unique', 'columns'))
+
+# natural_key: lookup paths used when another file references a row of
+# this model; unique: attnames used to skip rows that already exist;
+# columns: default header of CSV files without one.
+SPECS = {
+    'user': Spec(MyUser, ('username',), ('username',), None),
+    'tag': Spec(Tag, ('slug',), ('slug',), None),
+    'ingredient': Spec(
+        Ingredient,
+        ('name', 'measurement_unit'),
+        ('name', 'measurement_unit'),
+        ('name', 'measurement_unit')
+    ),
+    'recipe': Spec(
+        Recipe, ('author__username', 'name'), ('author_id', 'name'), None
+    ),
+    'recipeingredient': Spec(
+        RecipeIngredient, None, ('recipe_id', 'ingredient_id'), None
+    ),
+    'recipetag': Spec(RecipeTag, None, ('recipe_id', 'tags_id'), None),
+    'subscription': Spec(Subscription, None, ('user_id', 'author_id'), None),
+    'favorite': Spec(Favorite, None, ('user_id', 'recipes_id'), None),
+    'shoppingcart': Spec(ShoppingCart, None, ('user_id', 'recipes_id'), None),
+}
+KEY_SEPARATOR = '|'
+COPY_NULL = r'\N'
 
 
 class Command(BaseCommand):
-    help = 'Import initial data from file static/data/*.csv args sequensial'
+    help = (
+        'Bulk import CSV/JSONL data, by default from static/data/. '
+        'Files are loaded sequentially; the model is taken from --model '
+        'or from the file name (users.jsonl, recipes.csv, ...). '
+        'Foreign keys are given by natural key (recipe: "author|name", '
+        'ingredient: "name|unit") or by id in <field>_id columns.'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('files', nargs='+', type=str)
+        parser.add_argument(
+            '--model',
+            choices=sorted(SPECS),
+            help='Model of every file; inferred from the file name if unset.'
+        )
+        parser.add_argument(
+            '--fields',
+            help='Comma separated columns of a CSV file without a header.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows per INSERT or COPY.'
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Use bulk_create even on PostgreSQL.'
+        )
+        parser.add_argument(
+            '--reuse-password-hashes',
+            action='store_true',
+            help=(
+                'Hash every distinct password once, for seeding: users '
+                'with the same password get the same salt and hash.'
+            )
+        )
 
     def handle(self, *args, **options):
-        with open(
-            os.path.join(
-                BASE_DIR, 'static/data/{}'.format(options['files'][0])
-            ),
-            encoding='utf-8'
-        ) as f:
+        self.keys = {}
+        self.password_hashes = (
+            {} if options['reuse_password_hashes'] else None
+        )
+        self.use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        for file_name in options['files']:
+            spec = SPECS[options['model'] or self.guess_model(file_name)]
+            self.import_file(
+                self.resolve_path(file_name),
+                spec,
+                options['fields'],
+                options['batch_size']
+            )
+
+    def guess_model(self, file_name):
+        stem = os.path.basename(file_name).split('.')[0].lower()
+        stem = stem.replace('_', '')
+        for name in (stem, stem[:-1]):
+            if name in SPECS:
+                return name
+        raise CommandError(
+            f'{file_name}: не удалось определить модель по имени файла, '
+            'укажите --model'
+        )
+
+    def resolve_path(self, file_name):
+        if os.path.exists(file_name):
+            return file_name
+        path = os.path.join(settings.BASE_DIR, 'static/data', file_name)
+        if not os.path.exists(path):
+            raise CommandError(f'Файл {file_name} не найден')
+        return path
+
+    def read_rows(self, path, spec, fields):
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+                return
             reader = csv.reader(f)
+            columns = fields.split(',') if fields else None
             for row in reader:
-                Ingredient.objects.get_or_create(
-                    name=row[0],
-                    measurement_unit=row[1],
-                )
+                if columns is None:
+                    if set(row) <= self.known_columns(spec.model):
+                        columns = row
+                        continue
+                    # Only rows as wide as the default columns can be
+                    # data: anything else is a header of another model.
+                    columns = spec.columns
+                    if columns is None or len(row) != len(columns):
+                        raise CommandError(
+                            f'{path}: неизвестные столбцы '
+                            f'{", ".join(row)}; нужен заголовок модели '
+                            f'{spec.model.__name__} или --fields'
+                        )
+                yield dict(zip(columns, row))
+
+    def known_columns(self, model):
+        columns = set()
+        for field in model._meta.concrete_fields:
+            columns.update((field.name, field.attname))
+        return columns
+
+    def natural_keys(self, spec):
+        if spec.model not in self.keys:
+            self.keys[spec.model] = {
+                tuple(str(value) for value in key): pk
+                for *key, pk in spec.model.objects.values_list(
+                    *spec.natural_key, 'pk'
+                ).iterator()
+            }
+        return self.keys[spec.model]
+
+    def resolve_key(self, field, value):
+        spec = next(
+            spec for spec in SPECS.values()
+            if spec.model is field.related_model
+        )
+        if isinstance(value, str):
+            value = value.split(KEY_SEPARATOR)
+        elif not isinstance(value, (list, tuple)):
+            value = [value]
+        return self.natural_keys(spec).get(tuple(str(v) for v in value))
+
+    def hash_password(self, raw_password):
+        if self.password_hashes is None:
+            return make_password(raw_password)
+        if raw_password not in self.password_hashes:
+            self.password_hashes[raw_password] = make_password(raw_password)
+        return self.password_hashes[raw_password]
+
+    def build(self, spec, row):
+        values = {}
+        for field in spec.model._meta.concrete_fields:
+            if field.is_relation and field.name in row:
+                pk = self.resolve_key(field, row[field.name])
+                if pk is None:
+                    return None
+                values[field.attname] = pk
+            elif field.attname in row:
+                value = row[field.attname]
+                if value == '' and field.null:
+                    value = None
+                elif field.attname == 'password':
+                    value = self.hash_password(value)
+                elif value is not None:
+                    value = field.to_python(value)
+                values[field.attname] = value
+        return spec.model(**values)
+
+    @transaction.atomic
+    def import_file(self, path, spec, fields, batch_size):
+        started = time.monotonic()
+        existing = set(
+            spec.model.objects.values_list(*spec.unique).iterator()
+        )
+        inserted = skipped = unresolved = 0
+        explicit_pk = False
+        loaded = []
+        batch = []
+        for row in self.read_rows(path, spec, fields):
+            obj = self.build(spec, row)
+            if obj is None:
+                unresolved += 1
+                continue
+            key = tuple(getattr(obj, attname) for attname in spec.unique)
+            if key in existing:
+                skipped += 1
+                continue
+            existing.add(key)
+            explicit_pk = explicit_pk or obj.pk is not None
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                self.insert(spec.model, batch)
+                recount(spec.model, batch)
+                inserted += len(batch)
+                loaded.extend(self.affected(spec, batch))
+                batch = []
+        self.insert(spec.model, batch)
+        recount(spec.model, batch)
+        inserted += len(batch)
+        loaded.extend(self.affected(spec, batch))
+        self.keys.pop(spec.model, None)
+        if explicit_pk:
+            self.reset_sequence(spec.model)
+        self.update_shopping_lists(spec, loaded)
+        self.update_timelines(spec, loaded)
+        if spec.model is Ingredient and inserted:
+            transaction.on_commit(lambda: bump_version('ingredients'))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{os.path.basename(path)} ({spec.model.__name__}): '
+            f'inserted {inserted}, skipped {skipped}, '
+            f'unresolved {unresolved} in {elapsed:.2f}s '
+            f'({(inserted + skipped) / max(elapsed, 1e-6):.0f} rows/s)'
+        ))
+
+    def insert(self, model, batch):
+        if not batch:
+            return
+        with_pk = all(obj.pk is not None for obj in batch)
+        if not self.use_copy or (
+            not with_pk and any(obj.pk is not None for obj in batch)
+        ):
+            model.objects.bulk_create(batch)
+            return
+        fields = [
+            field for field in model._meta.concrete_fields
+            if with_pk or not field.primary_key
+        ]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for obj in batch:
+            writer.writerow([
+                self.copy_value(field.get_db_prep_save(
+                    field.pre_save(obj, True), connection
+                ))
+                for field in fields
+            ])
+        buffer.seek(0)
+        columns = ', '.join(
+            connection.ops.quote_name(field.column) for field in fields
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {connection.ops.quote_name(model._meta.db_table)} '
+                f"({columns}) FROM STDIN "
+                f"WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                buffer
+            )
+
+    def copy_value(self, value):
+        return COPY_NULL if value is None else value
+
+    def reset_sequence(self, model):
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                cursor.execute(sql)
+
+    def affected(self, spec, batch):
+        if spec.model is ShoppingCart:
+            return [obj.user_id for obj in batch]
+        if spec.model is RecipeIngredient:
+            return [obj.recipe_id for obj in batch]
+        if spec.model is Recipe:
+            return [obj.author_id for obj in batch]
+        if spec.model is Subscription:
+            return [obj.user_id for obj in batch]
+        return []
+
+    def update_shopping_lists(self, spec, loaded):
+        if not loaded:
+            return
+        if spec.model is ShoppingCart:
+            users = set(loaded)
+        elif spec.model is RecipeIngredient:
+            users = ShoppingCart.objects.filter(
+                recipes__in=set(loaded)
+            ).values('user_id')
+        else:
+            return
+        ShoppingCartIngredient.objects.rebuild(users)
+
+    def update_timelines(self, spec, loaded):
+        if not loaded:
+            return
+        if spec.model is Subscription:
+            TimelineEntry.objects.rebuild(set(loaded))
+        elif spec.model is Recipe:
+            TimelineEntry.objects.copy(
+                author__in=set(loaded),
+                author__subscribers_count__lte=settings.FEED_FANOUT_LIMIT
+            )
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes import images, workers
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Make the resized variants of recipe images that do not have '
+        'them yet: uploads made before the variants existed or whose '
+        'worker did not finish.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Remake the variants of every recipe image.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_thumbnail='')
+        recipe_ids = list(recipes.values_list('id', flat=True))
+        if settings.IMAGE_WORKERS:
+            done = images.get_executor().map(
+                workers.make_variants, recipe_ids
+            )
+        else:
+            done = map(images.make_variants, recipe_ids)
+        processed = sum(done)
+        self.stdout.write(
+            f'Processed {processed} of {len(recipe_ids)} recipe images'
+        )
@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from recipes.counters import COUNTERS, actual_count
+from recipes.models import ShoppingCartIngredient
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized counters and report drifted rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report rows whose counters drifted.'
+        )
+        parser.add_argument(
+            '--shopping-lists',
+            action='store_true',
+            help='Also rebuild every shopping list from the carts.'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model, counter, related, field in COUNTERS:
+            drifted = model.objects.annotate(
+                actual=actual_count(related, field)
+            ).exclude(**{counter: F('actual')})
+            if options['dry_run']:
+                fixed = drifted.count()
+            else:
+                fixed = model.objects.filter(
+                    pk__in=drifted.values('pk')
+                ).update(**{counter: actual_count(related, field)})
+            self.stdout.write(
+                f'{model.__name__}.{counter}: {fixed} drifted rows'
+            )
+        if options['shopping_lists'] and not options['dry_run']:
+            ShoppingCartIngredient.objects.rebuild(User.objects.values('id'))
+            self.stdout.write('Shopping lists rebuilt')
@@ -0,0 +1,102 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from recipes.models import Favorite, RecipeRank, ShoppingCart
+
+EVENTS = (Favorite, ShoppingCart)
+
+
+def window_scores(since, recipes=None):
+    scores = Counter()
+    for model in EVENTS:
+        events = model.objects.filter(created__gte=since)
+        if recipes is not None:
+            events = events.filter(recipes__in=recipes)
+        scores.update(dict(events.order_by().values_list(
+            'recipes'
+        ).annotate(total=Count('id'))))
+    return scores
+
+
+def rank(scores):
+    return sorted(
+        ((recipe, score) for recipe, score in scores.items() if score),
+        key=lambda item: (-item[1], -item[0])
+    )[:settings.TRENDING_SIZE]
+
+
+def covers_cutoff(top, ranked):
+    """Whether an incremental ranking can be trusted.
+
+    Recipes left out of it kept their score, which was below the last
+    ranked one unless the previous ranking had room for every recipe
+    with a score. The new ranking must still be full and end at or
+    above that cutoff.
+    """
+    if len(ranked) < settings.TRENDING_SIZE:
+        return True
+    cutoff = min((score, recipe) for recipe, score in ranked.items())
+    return (
+        len(top) == settings.TRENDING_SIZE
+        and (top[-1][1], top[-1][0]) >= cutoff
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the trending recipes ranking. Only recipes with '
+        'favorites or cart additions since the previous run, events that '
+        'left the window and already ranked recipes are rescored; when '
+        'ranked recipes lose enough score for an unranked one to move up, '
+        'everything is rescored. Use --full after raising TRENDING_SIZE.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rescore every recipe with events in the window.'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        now = timezone.now()
+        window = timedelta(days=settings.TRENDING_WINDOW_DAYS)
+        since = now - window
+        ranked = dict(RecipeRank.objects.values_list('recipe_id', 'score'))
+        last_run = RecipeRank.objects.aggregate(
+            last_run=Max('refreshed_at')
+        )['last_run']
+        if options['full'] or last_run is None:
+            top = rank(window_scores(since))
+        else:
+            touched = set(ranked)
+            for model in EVENTS:
+                touched.update(model.objects.filter(
+                    Q(created__gte=last_run)
+                    | Q(created__gte=last_run - window, created__lt=since)
+                ).values_list('recipes', flat=True).distinct())
+            top = rank(window_scores(since, touched))
+            if not covers_cutoff(top, ranked):
+                self.stdout.write('Cutoff not covered, rescoring everything')
+                top = rank(window_scores(since))
+        RecipeRank.objects.all().delete()
+        RecipeRank.objects.bulk_create(
+            RecipeRank(
+                recipe_id=recipe,
+                position=position,
+                score=score,
+                refreshed_at=now
+            )
+            for position, (recipe, score) in enumerate(top, 1)
+        )
+        self.stdout.write(
+            f'Ranked {len(top)} recipes, '
+            f'previously ranked {len(ranked)}'
+        )
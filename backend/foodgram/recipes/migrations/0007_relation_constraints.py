@@ -0,0 +1,87 @@
+# Generated by Django 3.2.13 on 2026-10-18 16:45
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+RELATIONS = (
+    ('Favorite', ('user', 'recipes')),
+    ('ShoppingCart', ('user', 'recipes')),
+    ('Subscription', ('user', 'author')),
+    ('RecipeTag', ('recipe', 'tags')),
+)
+
+
+def remove_duplicates(apps, schema_editor):
+    removed = {}
+    for model_name, fields in RELATIONS:
+        model = apps.get_model('recipes', model_name)
+        keep = model.objects.values(*fields).annotate(
+            keep_id=models.Min('id')
+        ).values('keep_id')
+        removed[model_name], _ = model.objects.exclude(id__in=keep).delete()
+    Subscription = apps.get_model('recipes', 'Subscription')
+    Subscription.objects.filter(user=models.F('author')).delete()
+    if removed['ShoppingCart']:
+        rebuild_shopping_lists(apps)
+
+
+def rebuild_shopping_lists(apps):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartIngredient = apps.get_model(
+        'recipes', 'ShoppingCartIngredient'
+    )
+    ShoppingCartIngredient.objects.all().delete()
+    totals = RecipeIngredient.objects.filter(
+        recipe__shopping_cart__isnull=False
+    ).values(
+        'recipe__shopping_cart__user', 'ingredient'
+    ).annotate(total=models.Sum('amount')).order_by()
+    ShoppingCartIngredient.objects.bulk_create(
+        (
+            ShoppingCartIngredient(
+                user_id=row['recipe__shopping_cart__user'],
+                ingredient_id=row['ingredient'],
+                amount=row['total']
+            ) for row in totals.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_relation_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='favorite',
+            name='favorite_user_recipe_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='shoppingcart',
+            name='shoppingcart_user_recipe_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipes'), name='unique_favorite'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipetag',
+            constraint=models.UniqueConstraint(fields=('recipe', 'tags'), name='unique_recipe_tag'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipes'), name='unique_shoppingcart'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_subscription'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.CheckConstraint(check=models.Q(('user', django.db.models.expressions.F('author')), _negated=True), name='no_self_subscription'),
+        ),
+    ]
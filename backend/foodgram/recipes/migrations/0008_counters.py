@@ -0,0 +1,50 @@
+# Generated by Django 3.2.13 on 2026-10-18 16:46
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count(model, field):
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).values(
+            field
+        ).annotate(total=models.Count('id')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    Subscription = apps.get_model('recipes', 'Subscription')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Recipe.objects.update(favorites_count=count(Favorite, 'recipes'))
+    User.objects.update(
+        recipes_count=count(Recipe, 'author'),
+        subscribers_count=count(Subscription, 'author')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_counters'),
+        ('recipes', '0007_relation_constraints'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recipe',
+            name='is_favorited',
+        ),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='is_in_shopping_cart',
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном у пользователей'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
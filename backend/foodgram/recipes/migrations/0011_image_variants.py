@@ -0,0 +1,23 @@
+# Generated by Django 3.2.13 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_medium',
+            field=models.ImageField(blank=True, upload_to='recipes/medium/', verbose_name='Картинка среднего размера'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, upload_to='recipes/thumbnail/', verbose_name='Миниатюра'),
+        ),
+    ]
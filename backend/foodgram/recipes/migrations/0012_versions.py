@@ -0,0 +1,24 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Version',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='Имя')),
+                ('value', models.FloatField(verbose_name='Время изменения')),
+            ],
+            options={
+                'verbose_name': 'Версия',
+                'verbose_name_plural': 'Версии',
+            },
+        ),
+    ]
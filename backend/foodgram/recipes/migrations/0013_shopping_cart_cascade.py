@@ -0,0 +1,19 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:39
+
+from django.db import migrations, models
+import recipes.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_versions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shoppingcart',
+            name='recipes',
+            field=models.ForeignKey(on_delete=recipes.models.cascade_shopping_lists, related_name='shopping_cart', to='recipes.recipe', verbose_name='Рецепты в корзине'),
+        ),
+    ]
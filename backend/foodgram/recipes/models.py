@@ -1,10 +1,23 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
 
 User = get_user_model()
 
 
+class RelationManager(models.Manager):
+
+    def add(self, **kwargs):
+        """Insert a row unless it already exists; True if inserted."""
+        try:
+            with transaction.atomic():
+                self.create(**kwargs)
+        except IntegrityError:
+            return False
+        return True
+
+
 class Tag(models.Model):
     name = models.CharField('Название', max_length=200)
     color = models.CharField(
@@ -60,13 +73,9 @@ class Recipe(models.Model):
     )
     name = models.CharField('Название', max_length=200)
     text = models.TextField('Описание')
-    is_favorited = models.BooleanField(
-        'Находится ли в избранном',
-        default=False
-    )
-    is_in_shopping_cart = models.BooleanField(
-        'Находится ли в корзине',
-        default=False
+    favorites_count = models.PositiveIntegerField(
+        'В избранном у пользователей',
+        default=0
     )
     cooking_time = models.PositiveIntegerField(
         'Время приготовления (мин)',
@@ -79,6 +88,20 @@ class Recipe(models.Model):
         upload_to='recipes/',
         blank=True
     )
+    image_thumbnail = models.ImageField(
+        'Миниатюра',
+        upload_to='recipes/thumbnail/',
+        blank=True
+    )
+    image_medium = models.ImageField(
+        'Картинка среднего размера',
+        upload_to='recipes/medium/',
+        blank=True
+    )
+    pub_date = models.DateTimeField(
+        'Дата публикации',
+        auto_now_add=True
+    )
 
     def get_tags(self):
         return ",\n".join([p.name for p in self.tags.all()])
@@ -87,6 +110,13 @@ class Recipe(models.Model):
         return ",\n".join([p.name for p in self.ingredients.all()])
 
     class Meta:
+        ordering = ('-pub_date', '-id')
+        indexes = (
+            models.Index(
+                fields=('pub_date', 'id'),
+                name='recipe_pub_date_id_idx'
+            ),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -116,6 +146,18 @@ class RecipeTag(models.Model):
     tags = models.ForeignKey(Tag, on_delete=models.CASCADE)
 
     class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'tags'),
+                name='unique_recipe_tag'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('tags', 'recipe'),
+                name='recipetag_tag_recipe_idx'
+            ),
+        )
         verbose_name = 'Тег рецепта'
         verbose_name_plural = 'Теги рецептов'
 
@@ -137,7 +179,19 @@ class Subscription(models.Model):
         verbose_name='Пользователь, на которого подписались'
     )
 
+    objects = RelationManager()
+
     class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'author'),
+                name='unique_subscription'
+            ),
+            models.CheckConstraint(
+                check=~models.Q(user=models.F('author')),
+                name='no_self_subscription'
+            ),
+        )
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 
@@ -158,8 +212,21 @@ class Favorite(models.Model):
         related_name='favorite',
         verbose_name='Избранный рецепт'
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
+
+    objects = RelationManager()
 
     class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipes'),
+                name='unique_favorite'
+            ),
+        )
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
 
@@ -167,6 +234,13 @@ class Favorite(models.Model):
         return str(self.user)
 
 
+def cascade_shopping_lists(collector, field, sub_objs, using):
+    """CASCADE that first takes the deleted recipes off the shopping
+    lists, once for every batch of carts being deleted."""
+    ShoppingCartIngredient.objects.remove_carts(sub_objs)
+    models.CASCADE(collector, field, sub_objs, using)
+
+
 class ShoppingCart(models.Model):
     user = models.ForeignKey(
         User,
@@ -176,14 +250,307 @@ class ShoppingCart(models.Model):
     )
     recipes = models.ForeignKey(
         Recipe,
-        on_delete=models.CASCADE,
+        on_delete=cascade_shopping_lists,
         related_name='shopping_cart',
         verbose_name='Рецепты в корзине'
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
+
+    objects = RelationManager()
 
     class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipes'),
+                name='unique_shoppingcart'
+            ),
+        )
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
 
     def __str__(self) -> str:
         return f'{self.user.username}'
+
+
+class RecipeRank(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='rank',
+        verbose_name='Рецепт'
+    )
+    position = models.PositiveIntegerField('Место', unique=True)
+    score = models.PositiveIntegerField('Очки')
+    refreshed_at = models.DateTimeField('Дата пересчёта')
+
+    class Meta:
+        ordering = ('position',)
+        verbose_name = 'Место в рейтинге'
+        verbose_name_plural = 'Рейтинг рецептов'
+
+    def __str__(self):
+        return f'{self.position}. {self.recipe}'
+
+
+class Version(models.Model):
+    name = models.CharField('Имя', max_length=64, primary_key=True)
+    value = models.FloatField('Время изменения')
+
+    class Meta:
+        verbose_name = 'Версия'
+        verbose_name_plural = 'Версии'
+
+    def __str__(self):
+        return self.name
+
+
+class ShoppingCartIngredientManager(models.Manager):
+
+    @transaction.atomic
+    def apply(self, users, amounts):
+        """Add ``amounts`` ({ingredient_id: delta}) to the lists of ``users``.
+
+        ``users`` may be a list of ids or a queryset of user ids. Missing
+        rows are inserted with a zero amount first, so concurrent calls
+        only meet in the UPDATE, which adds every delta at once.
+        """
+        amounts = {
+            ingredient_id: delta
+            for ingredient_id, delta in amounts.items() if delta
+        }
+        if not amounts:
+            return
+        added = [
+            ingredient_id for ingredient_id, delta in amounts.items()
+            if delta > 0
+        ]
+        if added:
+            if not isinstance(users, (list, tuple, set)):
+                users = list(User.objects.filter(id__in=users).values_list(
+                    'id', flat=True
+                ))
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=0
+                    ) for user_id in users for ingredient_id in added
+                ),
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+        rows = self.filter(user__in=users, ingredient_id__in=amounts)
+        rows.update(amount=models.F('amount') + models.Case(
+            *(
+                models.When(ingredient_id=ingredient_id, then=delta)
+                for ingredient_id, delta in amounts.items()
+            ),
+            output_field=models.IntegerField()
+        ))
+        rows.filter(amount__lte=0).delete()
+
+    def recipe_amounts(self, recipe, times=1):
+        amounts = {}
+        for ingredient_id, amount in RecipeIngredient.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient_id', 'amount'):
+            amounts[ingredient_id] = (
+                amounts.get(ingredient_id, 0) + amount * times
+            )
+        return amounts
+
+    def add_recipe(self, user, recipe, times=1):
+        self.apply([user.id], self.recipe_amounts(recipe, times))
+
+    def remove_recipe(self, user, recipe, times=1):
+        self.add_recipe(user, recipe, -times)
+
+    @transaction.atomic
+    def rebuild(self, users):
+        self.filter(user__in=users).delete()
+        totals = RecipeIngredient.objects.filter(
+            recipe__shopping_cart__user__in=users
+        ).values(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=models.Sum('amount')).order_by()
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=row['recipe__shopping_cart__user'],
+                    ingredient_id=row['ingredient'],
+                    amount=row['total']
+                ) for row in totals.iterator()
+            ),
+            batch_size=1000
+        )
+
+    def change_recipe(self, recipe, amounts):
+        self.apply(
+            ShoppingCart.objects.filter(recipes=recipe).values('user_id'),
+            amounts
+        )
+
+    def remove_carts(self, carts):
+        """Take the recipes of ``carts`` (ShoppingCart rows) off the lists
+        of their users, with one query for the amounts of all of them."""
+        amounts = {}
+        for row in RecipeIngredient.objects.filter(
+            recipe__shopping_cart__in=carts
+        ).values(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=models.Sum('amount')).order_by():
+            amounts.setdefault(row['recipe__shopping_cart__user'], {})[
+                row['ingredient']
+            ] = -row['total']
+        for user_id, user_amounts in amounts.items():
+            self.apply([user_id], user_amounts)
+
+
+class ShoppingCartIngredient(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField('Количество')
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_cart_ingredient'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient}'
+
+
+class TimelineEntryManager(models.Manager):
+    """Per-user feeds, written on publish for authors with at most
+    ``FEED_FANOUT_LIMIT`` subscribers and read on demand for the rest."""
+
+    def fans_out(self, author, subscribers_count=None):
+        if subscribers_count is None:
+            subscribers_count = author.subscribers_count
+        return subscribers_count <= settings.FEED_FANOUT_LIMIT
+
+    def copy(self, **lookups):
+        """Write timeline rows of the subscribers of matching recipes."""
+        rows = Recipe.objects.filter(**lookups).values_list(
+            'author__on_subscribe__user', 'id', 'pub_date'
+        ).order_by()
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    pub_date=pub_date
+                ) for user_id, recipe_id, pub_date in rows.iterator()
+            ),
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+
+    def fan_out(self, recipe):
+        if self.fans_out(recipe.author):
+            self.copy(pk=recipe.pk)
+
+    def follow(self, user, author):
+        if self.fans_out(author):
+            self.copy(author=author, author__on_subscribe__user=user)
+
+    def unfollow(self, user, author):
+        self.filter(user=user, recipe__author=author).delete()
+        if (
+            not self.fans_out(author)
+            and self.fans_out(author, author.subscribers_count - 1)
+        ):
+            self.copy(author=author)
+
+    @transaction.atomic
+    def rebuild(self, users):
+        self.filter(user__in=users).delete()
+        self.copy(
+            author__on_subscribe__user__in=users,
+            author__subscribers_count__lte=settings.FEED_FANOUT_LIMIT
+        )
+
+    def page(self, user, position, size):
+        """``(pub_date, recipe_id)`` of the next ``size`` feed rows after
+        ``position``, merging the timeline with large authors' recipes."""
+        written = self.filter(user=user)
+        read = Recipe.objects.filter(
+            author__on_subscribe__user=user,
+            author__subscribers_count__gt=settings.FEED_FANOUT_LIMIT
+        )
+        if position is not None:
+            pub_date, pk = position
+            written = written.filter(
+                models.Q(pub_date__lt=pub_date)
+                | models.Q(pub_date=pub_date, recipe_id__lt=pk)
+            )
+            read = read.filter(
+                models.Q(pub_date__lt=pub_date)
+                | models.Q(pub_date=pub_date, id__lt=pk)
+            )
+        rows = set(written.order_by('-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id'
+        )[:size])
+        rows.update(read.order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id'
+        )[:size])
+        return sorted(rows, reverse=True)[:size]
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    objects = TimelineEntryManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_timeline_entry'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='timeline_user_pub_date_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
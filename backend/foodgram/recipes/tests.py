@@ -0,0 +1,206 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .counters import change_counter
+from .models import (Favorite, Ingredient, Recipe, RecipeRank, ShoppingCart,
+                     Subscription, Version)
+from .versions import bump_version, get_version
+
+User = get_user_model()
+
+
+class ImportTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def load(self, file_name, content, *args):
+        path = os.path.join(self.directory, file_name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        call_command('import_csv_data', path, *args, stdout=StringIO())
+
+
+class ImportFileTest(ImportTestCase):
+    RECIPES = 'author,name,text,cooking_time\nauthor,суп,текст,10\n'
+
+    def test_unknown_file_name(self):
+        with self.assertRaises(CommandError):
+            self.load('recipes_x.csv', self.RECIPES)
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_header_of_another_model(self):
+        with self.assertRaises(CommandError):
+            self.load('recipes_x.csv', self.RECIPES, '--model=ingredient')
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_password_hashes(self):
+        users = (
+            'username,email,password\n'
+            'first,first@example.com,pass\n'
+            'second,second@example.com,pass\n'
+        )
+        self.load('users.csv', users)
+        first, second = User.objects.order_by('username')
+        self.assertNotEqual(first.password, second.password)
+        self.assertTrue(second.check_password('pass'))
+        User.objects.all().delete()
+        self.load('users.csv', users, '--reuse-password-hashes')
+        first, second = User.objects.order_by('username')
+        self.assertEqual(first.password, second.password)
+
+    def test_ingredients_without_header(self):
+        self.load('ingredients.csv', 'соль,г\nсахар,г\n')
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+
+class ImportCountersTest(ImportTestCase):
+
+    def test_import_updates_counters(self):
+        self.load('users.csv', (
+            'username,email,password\n'
+            'author,author@example.com,pass\n'
+            'reader,reader@example.com,pass\n'
+        ))
+        self.load('recipes.csv', (
+            'author,name,text,cooking_time\n'
+            'author,суп,текст,10\n'
+        ))
+        self.load('favorites.csv', 'user,recipes\nreader,author|суп\n')
+        self.load('subscriptions.csv', 'user,author\nreader,author\n')
+        author = User.objects.get(username='author')
+        self.assertEqual(author.recipes_count, 1)
+        self.assertEqual(author.subscribers_count, 1)
+        self.assertEqual(Recipe.objects.get().favorites_count, 1)
+
+    def test_counter_does_not_go_below_zero(self):
+        user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass'
+        )
+        change_counter(user, 'subscribers_count', -1)
+        user.refresh_from_db()
+        self.assertEqual(user.subscribers_count, 0)
+
+
+@override_settings(TRENDING_SIZE=1, TRENDING_WINDOW_DAYS=7)
+class RefreshTrendingTest(TestCase):
+
+    def test_recipe_below_cutoff_moves_up(self):
+        users = [
+            User.objects.create_user(
+                username=f'user{index}',
+                email=f'user{index}@example.com',
+                password='pass'
+            ) for index in range(3)
+        ]
+        old, recent = [
+            Recipe.objects.create(
+                author=users[0], name=name, text='текст', cooking_time=10
+            ) for name in ('old', 'recent')
+        ]
+        now = timezone.now()
+        for user in users:
+            Favorite.objects.create(user=user, recipes=old)
+        for user in users[:2]:
+            Favorite.objects.create(user=user, recipes=recent)
+        Favorite.objects.filter(recipes=old).update(
+            created=now - timedelta(days=6)
+        )
+        Favorite.objects.filter(recipes=recent).update(
+            created=now - timedelta(days=1)
+        )
+        call_command('refresh_trending', stdout=StringIO())
+        self.assertEqual(RecipeRank.objects.get().recipe, old)
+        # Two days later the old favorites have left the window.
+        for model, field in ((Favorite, 'created'),
+                             (RecipeRank, 'refreshed_at')):
+            for obj in model.objects.all():
+                model.objects.filter(pk=obj.pk).update(**{
+                    field: getattr(obj, field) - timedelta(days=2)
+                })
+        call_command('refresh_trending', stdout=StringIO())
+        self.assertEqual(RecipeRank.objects.get().recipe, recent)
+
+
+class RelationIndexTest(TestCase):
+    """Per-user lookups of the viewer context and the add/remove actions
+    are served by the unique (user, target) indexes."""
+    RELATIONS = (
+        (Favorite, 'recipes'),
+        (ShoppingCart, 'recipes'),
+        (Subscription, 'author'),
+    )
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are otherwise read sequentially.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def unique_index(self, model, fields):
+        columns = [model._meta.get_field(field).column for field in fields]
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor != 'sqlite':
+                constraints = connection.introspection.get_constraints(
+                    cursor, table
+                )
+                return next(
+                    name for name, constraint in constraints.items()
+                    if constraint['unique']
+                    and constraint['columns'] == columns
+                )
+            # SQLite names the index of a UNIQUE table constraint itself.
+            cursor.execute(f'PRAGMA index_list("{table}")')
+            for _, name, unique, *_ in cursor.fetchall():
+                cursor.execute(f'PRAGMA index_info("{name}")')
+                if unique and [
+                    row[2] for row in cursor.fetchall()
+                ] == columns:
+                    return name
+        return None
+
+    def test_lookups_use_unique_index(self):
+        for model, target in self.RELATIONS:
+            index = self.unique_index(model, ('user', target))
+            self.assertIsNotNone(index)
+            for queryset in (
+                model.objects.filter(user=1).values_list(
+                    f'{target}_id', flat=True
+                ),
+                model.objects.filter(user=1, **{target: 2}),
+            ):
+                with self.subTest(model=model.__name__, query=str(
+                    queryset.query
+                )):
+                    self.assertIn(index, queryset.explain())
+
+
+class VersionTest(TestCase):
+
+    @override_settings(VERSION_CACHE_TTL=60)
+    def test_read_once_per_ttl(self):
+        version = get_version('tags')
+        Version.objects.filter(name='tags').update(value=version + 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_version('tags'), version)
+        bump_version('tags')
+        with self.assertNumQueries(0):
+            bumped = get_version('tags')
+        self.assertEqual(bumped, Version.objects.get(name='tags').value)
+
+    @override_settings(VERSION_CACHE_TTL=0)
+    def test_other_process_bump(self):
+        version = get_version('tags')
+        Version.objects.filter(name='tags').update(value=version + 1)
+        self.assertEqual(get_version('tags'), version + 1)
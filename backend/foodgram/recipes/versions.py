@@ -0,0 +1,70 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Version
+
+# Versions are modification timestamps kept in the database, so every
+# worker process and management command sees the same value, which serves
+# both as a change counter and as Last-Modified. Each process keeps what it
+# read for VERSION_CACHE_TTL seconds: bumps from other processes show up
+# after at most that long, bumps made here at once.
+_versions = {}
+_lock = threading.Lock()
+VERSIONS_MAX = 10000
+
+
+def remember(versions):
+    loaded = time.monotonic()
+    with _lock:
+        if len(_versions) + len(versions) > VERSIONS_MAX:
+            _versions.clear()
+        for name, value in versions.items():
+            _versions[name] = (value, loaded)
+
+
+def get_versions(names):
+    """Versions of ``names`` in the same order; missing ones are created."""
+    oldest = time.monotonic() - settings.VERSION_CACHE_TTL
+    with _lock:
+        cached = {name: _versions.get(name) for name in names}
+    versions = {
+        name: entry[0] for name, entry in cached.items()
+        if entry is not None and entry[1] > oldest
+    }
+    stale = [name for name in names if name not in versions]
+    if stale:
+        loaded = dict(
+            Version.objects.filter(name__in=stale).values_list(
+                'name', 'value'
+            )
+        )
+        missing = [name for name in stale if name not in loaded]
+        if missing:
+            now = time.time()
+            Version.objects.bulk_create(
+                (Version(name=name, value=now) for name in missing),
+                ignore_conflicts=True
+            )
+            loaded.update(
+                Version.objects.filter(name__in=missing).values_list(
+                    'name', 'value'
+                )
+            )
+        remember(loaded)
+        versions.update(loaded)
+    return [versions[name] for name in names]
+
+
+def get_version(name):
+    return get_versions([name])[0]
+
+
+def bump_version(name):
+    now = time.time()
+    if not Version.objects.filter(name=name).update(value=now):
+        Version.objects.bulk_create(
+            [Version(name=name, value=now)], ignore_conflicts=True
+        )
+    remember({name: now})
@@ -0,0 +1,26 @@
+"""Entry points of the image worker processes.
+
+The pool starts workers with ``spawn``, so this module must be importable
+before Django is set up: models are only imported inside the tasks.
+"""
+import os
+
+import django
+from django.db import close_old_connections
+
+
+def init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def make_variants(recipe_id):
+    from .images import make_variants
+
+    # Workers outlive requests, so connections are checked like at the
+    # start and end of a request: broken or past CONN_MAX_AGE ones close.
+    close_old_connections()
+    try:
+        return make_variants(recipe_id)
+    finally:
+        close_old_connections()
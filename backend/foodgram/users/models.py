@@ -24,6 +24,14 @@ class MyUser(AbstractUser):
         unique=True,
         verbose_name='Адрес электронной почты'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество рецептов'
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество подписчиков'
+    )
 
     class Meta:
         verbose_name = 'Пользователь'